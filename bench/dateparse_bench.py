@@ -0,0 +1,69 @@
+"""Микробенчмарк разбора сроков задач (dateparse.parse_due).
+
+Для каждой формы срока из корпуса dateparse_corpus.tsv измеряется время одного
+вызова parse_due с текстом задачи после срока. Для сравнения измеряется прежний
+разбор '/add YYYY-MM-DD HH:MM' через datetime.strptime.
+
+Пример:
+    python bench/dateparse_bench.py --number 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bot"))
+
+from dateparse import parse_due  # noqa: E402
+from dateparse_check import CORPUS, CORPUS_NOW  # noqa: E402
+
+
+def load_inputs():
+    inputs = []
+    with open(CORPUS, encoding="utf-8") as corpus:
+        for line in corpus:
+            line = line.rstrip("\n")
+            if line and not line.startswith("#"):
+                inputs.append(line.split("\t")[0].split())
+    return inputs
+
+
+def try_parse(args):
+    try:
+        parse_due(args, CORPUS_NOW)
+    except ValueError:
+        pass
+
+
+def legacy_parse(args):
+    return datetime.strptime(f"{args[0]} {args[1]}", "%Y-%m-%d %H:%M"), " ".join(args[2:])
+
+
+def measure(func, args, number, repeat):
+    return min(timeit.repeat(lambda: func(args), number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=10000, help="вызовов в одном замере")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров, берётся лучший")
+    args = parser.parse_args()
+
+    inputs = load_inputs()
+    results = [(" ".join(item), measure(try_parse, item, args.number, args.repeat)) for item in inputs]
+    width = max(len(text) for text, _ in results)
+    print(f"{'аргументы /add':{width}} {'мкс/вызов':>10}")
+    for text, micros in results:
+        print(f"{text:{width}} {micros:10.2f}")
+
+    total = sorted(micros for _, micros in results)
+    print()
+    print(f"медиана {total[len(total) // 2]:.2f} мкс, максимум {total[-1]:.2f} мкс")
+    legacy = measure(legacy_parse, "2024-12-05 14:30 Купить продукты".split(), args.number, args.repeat)
+    print(f"прежний разбор strptime '2024-12-05 14:30 ...': {legacy:.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
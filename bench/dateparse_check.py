@@ -0,0 +1,161 @@
+"""Проверка разбора сроков задач (dateparse) на корпусе и случайных входах.
+
+Корпус dateparse_corpus.tsv содержит примеры аргументов /add с ожидаемым сроком
+и текстом задачи относительно фиксированного момента. Затем для --samples
+случайных моментов и входов проверяются свойства:
+
+    - 'через N <единица>' даёт ровно now + N единиц при любой форме слова;
+    - день недели даёт этот день недели в пределах недели после now;
+    - 'DD.MM HH:MM' без года и одно время дают срок в будущем, не дальше года;
+    - регистр не влияет на результат, а текст задачи остаётся нетронутым;
+    - parse_due_text принимает строку срока целиком и отвергает лишние слова.
+
+Код возврата 1, если проверка не пройдена.
+
+Пример:
+    python bench/dateparse_check.py --samples 100000
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bot"))
+
+from dateparse import UNITS, WEEKDAYS, parse_due, parse_due_text  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dateparse_corpus.tsv")
+CORPUS_NOW = datetime(2024, 6, 12, 10, 0)
+
+# Размер единицы для проверки интервалов
+STEPS = {
+    'seconds': relativedelta(seconds=1),
+    'minutes': relativedelta(minutes=1),
+    'hours': relativedelta(hours=1),
+    'days': relativedelta(days=1),
+    'weeks': relativedelta(weeks=1),
+    'months': relativedelta(months=1),
+    'years': relativedelta(years=1),
+}
+
+TEXTS = ("Купить молоко", "Позвонить маме", "Отчёт за квартал", "Call 5 people", "в магазин за хлебом")
+
+
+def parse_expected(value):
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"неверный ожидаемый срок в корпусе: {value!r}")
+
+
+def check_corpus(failures):
+    count = 0
+    with open(CORPUS, encoding="utf-8") as corpus:
+        for line in corpus:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            args = fields[0].split()
+            count += 1
+            try:
+                due, consumed = parse_due(args, CORPUS_NOW)
+            except ValueError as e:
+                if fields[1] != "error":
+                    failures.append(f"{fields[0]!r}: ошибка {e}")
+                continue
+            if fields[1] == "error":
+                failures.append(f"{fields[0]!r}: ожидалась ошибка, получено {due}")
+                continue
+            text = " ".join(args[consumed:])
+            if due != parse_expected(fields[1]) or text != fields[2]:
+                failures.append(f"{fields[0]!r}: получено {due} {text!r}, ожидалось {fields[1]} {fields[2]!r}")
+    return count
+
+
+def random_now():
+    return datetime(2020, 1, 1) + timedelta(minutes=random.randrange(10 * 366 * 24 * 60))
+
+
+def random_case(word):
+    return "".join(char.upper() if random.random() < 0.3 else char for char in word)
+
+
+def check_properties(samples, failures):
+    units = list(UNITS.items())
+    weekdays = list(WEEKDAYS.items())
+    for _ in range(samples):
+        now = random_now()
+        text = random.choice(TEXTS)
+        kind = random.randrange(4)
+        if kind == 0:
+            word, unit = random.choice(units)
+            value = random.randrange(0, 1000)
+            args = [random_case("через"), str(value), random_case(word)]
+            expected = now + STEPS[unit] * value
+            check = lambda due: due == expected  # noqa: E731
+        elif kind == 1:
+            word, weekday = random.choice(weekdays)
+            hour, minute = random.randrange(24), random.randrange(60)
+            args = ["в", random_case(word), f"{hour}:{minute:02d}"]
+            check = lambda due: (  # noqa: E731
+                due.weekday() == weekday and (due.hour, due.minute) == (hour, minute)
+                and now < due <= now + timedelta(weeks=1)
+            )
+        elif kind == 2:
+            day = now + timedelta(days=random.randrange(366))
+            hour, minute = random.randrange(24), random.randrange(60)
+            args = [f"{day.day:02d}.{day.month:02d}", f"{hour:02d}:{minute:02d}"]
+            check = lambda due: (  # noqa: E731
+                (due.day, due.month, due.hour, due.minute) == (day.day, day.month, hour, minute)
+                and now < due <= now + relativedelta(years=1, days=1)
+            )
+        else:
+            hour, minute = random.randrange(24), random.randrange(60)
+            args = [f"{hour}:{minute:02d}"]
+            check = lambda due: (  # noqa: E731
+                (due.hour, due.minute) == (hour, minute) and now < due <= now + timedelta(days=1)
+            )
+        try:
+            due, consumed = parse_due(args + text.split(), now)
+        except ValueError as e:
+            failures.append(f"{' '.join(args)!r} при {now}: ошибка {e}")
+            continue
+        if not check(due):
+            failures.append(f"{' '.join(args)!r} при {now}: получено {due}")
+        elif " ".join((args + text.split())[consumed:]) != text:
+            failures.append(f"{' '.join(args)!r} при {now}: текст задачи изменён")
+        elif parse_due_text(" ".join(args), now) != due:
+            failures.append(f"{' '.join(args)!r} при {now}: parse_due_text расходится с parse_due")
+        else:
+            try:
+                parse_due_text(" ".join(args) + " " + text, now)
+                failures.append(f"{' '.join(args)!r} при {now}: parse_due_text принял лишние слова")
+            except ValueError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=20000, help="количество случайных входов")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    failures = []
+    count = check_corpus(failures)
+    check_properties(args.samples, failures)
+    for failure in failures[:50]:
+        print(failure)
+    print(f"Корпус: {count} примеров, случайных входов: {args.samples}, ошибок: {len(failures)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Сервер отвечает на методы, которые использует бот, накапливает входящие
+обновления для getUpdates или доставляет их на webhook и записывает все
+исходящие вызовы с отметками времени.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+import httpx
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def _parse_body(headers, body):
+    """Разбор тела запроса PTB: form-urlencoded, значения которого закодированы в JSON."""
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    params = {}
+    for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+class FakeBotAPI:
+    """HTTP-сервер, имитирующий Bot API для одного бота."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, webhook_connections=40):
+        self.host = host
+        self.port = port
+        # Искусственная задержка ответа на исходящие вызовы (в секундах)
+        self.latency = latency
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.calls = Counter()
+        # Исходящие вызовы: (время, метод, chat_id, параметры)
+        self.sent = []
+        self._server = None
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._updates_event = asyncio.Event()
+        self._sent_event = asyncio.Event()
+        self._webhook_ready = asyncio.Event()
+        self._webhook_slots = asyncio.Semaphore(webhook_connections)
+        self._webhook_client = None
+        self._webhook_tasks = set()
+        self._listeners = []
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._webhook_client = httpx.AsyncClient(timeout=30)
+
+    async def stop(self):
+        for task in list(self._webhook_tasks):
+            task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._webhook_client is not None:
+            await self._webhook_client.aclose()
+
+    def add_listener(self, callback):
+        """Подписка на исходящие вызовы: callback(method, params, timestamp)."""
+        self._listeners.append(callback)
+
+    # --- входящие обновления -------------------------------------------------
+
+    def push_update(self, update):
+        """Поставить обновление в очередь (или отправить на webhook); возвращает update_id."""
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url:
+            task = asyncio.get_running_loop().create_task(self._post_webhook(update))
+            self._webhook_tasks.add(task)
+            task.add_done_callback(self._webhook_tasks.discard)
+        else:
+            self._updates.append(update)
+            self._updates_event.set()
+        return update["update_id"]
+
+    def message_update(self, user_id, text):
+        """Обновление с текстовым сообщением пользователя (команды размечаются как bot_command)."""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"message": message}
+
+    def callback_update(self, user_id, data, message_id=None):
+        """Обновление с нажатием inline кнопки в сообщении бота."""
+        return {
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "chat_instance": str(user_id),
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "data": data,
+                "message": {
+                    "message_id": message_id or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "...",
+                },
+            }
+        }
+
+    async def wait_webhook(self, timeout=30):
+        await asyncio.wait_for(self._webhook_ready.wait(), timeout)
+
+    async def wait_sent(self, count, method="sendMessage", timeout=120):
+        """Дождаться, пока бот выполнит count вызовов method."""
+        deadline = time.monotonic() + timeout
+        while self.calls[method] < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{method}: {self.calls[method]} из {count}")
+            self._sent_event.clear()
+            try:
+                await asyncio.wait_for(self._sent_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _post_webhook(self, update):
+        headers = {}
+        if self.webhook_secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+        async with self._webhook_slots:
+            await self._webhook_client.post(self.webhook_url, json=update, headers=headers)
+
+    # --- методы Bot API ------------------------------------------------------
+
+    def _message(self, params):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    async def _call(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            self.webhook_secret = params.get("secret_token")
+            self._webhook_ready.set()
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method in ("sendMessage", "sendDocument"):
+            return self._message(params)
+        if method == "editMessageText":
+            message = self._message(params)
+            message["message_id"] = int(params.get("message_id", message["message_id"]))
+            return message
+        return True
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    # --- HTTP ----------------------------------------------------------------
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                params = _parse_body(headers, body)
+                result = await self._call(method, params)
+                now = time.monotonic()
+                self.calls[method] += 1
+                if method not in ("getUpdates", "getMe"):
+                    self.sent.append((now, method, params.get("chat_id"), params))
+                    for listener in self._listeners:
+                        listener(method, params, now)
+                    self._sent_event.set()
+
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,34 @@
+"""Временная база данных PostgreSQL для нагрузочных тестов."""
+import uuid
+from urllib.parse import urlsplit, urlunsplit
+
+import asyncpg
+
+
+def with_database(url, name):
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"/{name}"))
+
+
+class ThrowawayDatabase:
+    """Временная база данных, удаляемая после теста."""
+
+    def __init__(self, admin_url):
+        self.admin_url = admin_url
+        self.name = f"bench_{uuid.uuid4().hex[:12]}"
+        self.url = with_database(admin_url, self.name)
+
+    async def __aenter__(self):
+        conn = await asyncpg.connect(self.admin_url)
+        try:
+            await conn.execute(f'CREATE DATABASE "{self.name}"')
+        finally:
+            await conn.close()
+        return self
+
+    async def __aexit__(self, *exc):
+        conn = await asyncpg.connect(self.admin_url)
+        try:
+            await conn.execute(f'DROP DATABASE IF EXISTS "{self.name}" WITH (FORCE)')
+        finally:
+            await conn.close()
@@ -1,11 +1,12 @@
 import logging
 import os
 import asyncio
+import tempfile
+import time
 from datetime import datetime, timedelta
 import re
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, TelegramError
 from telegram.ext import (
     Application, 
     CommandHandler, 
@@ -16,41 +17,207 @@ from telegram.ext import (
     filters
 )
 from dotenv import load_dotenv
-from db import create_task, get_tasks, create_table, delete_task, update_task
-from dateutil.relativedelta import relativedelta
 
-# Загрузка переменных окружения
+# Переменные окружения из .env загружаются один раз, до импорта модулей бота,
+# которые читают свои настройки при импорте
 load_dotenv()
 
-# Получаем токен Telegram и строку подключения к базе данных из .env
+from dateparse import parse_due, parse_due_text, parse_interval
+from db import (
+    create_task,
+    get_task,
+    get_tasks_page,
+    migrate,
+    delete_task,
+    delete_tasks,
+    postpone_tasks,
+    search_tasks,
+    complete_tasks,
+    get_history_page,
+    get_user_stats,
+    get_global_stats,
+    update_task,
+    init_pool,
+    close_pool,
+    pool_stats,
+    task_cache,
+    iter_tasks,
+    import_tasks,
+)
+from recurrence import describe, is_recurring, parse_recurrence
+from digest import ReminderCoalescer
+from logsetup import redact, setup_logging
+from maintenance import (
+    maintenance_job,
+    stats_reconcile_job,
+    TASK_MAINTENANCE_INTERVAL_HOURS,
+    STATS_RECONCILE_INTERVAL_HOURS,
+)
+from persistence import DatabasePersistence
+from reminders import ReminderDispatcher, REMINDER_LEASE_SECONDS
+from send_queue import SendQueue, PRIORITY_REMINDER
+from transfer import FORMATS, detect_format, iter_import_chunks, text_stream, write_export
+from update_processor import PerUserUpdateProcessor
+from metrics import Gauge, MetricsServer, REMINDER_LAG, TELEGRAM_ERRORS, timed_handler
+
+# Получаем токен Telegram из .env (строка подключения к базе данных читается в db.py)
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-DATABASE_URL = os.getenv("DATABASE_URL")
 
-if TELEGRAM_TOKEN is None:
-    raise ValueError("Не указан TELEGRAM_TOKEN в переменных окружения")
-if DATABASE_URL is None:
-    raise ValueError("Не указана DATABASE_URL в переменных окружения")
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Максимальное количество одновременно обрабатываемых обновлений
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# Адрес Bot API (например, локального сервера Bot API); по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Настройки webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# ID администраторов через запятую: в /stats им показывается и общая статистика
+ADMIN_IDS = frozenset(int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip())
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
-# Инициализация асинхронного планировщика (AsyncIO Scheduler)
-scheduler = AsyncIOScheduler()
-scheduler.start()
+
+def _process_started():
+    """Момент запуска процесса по часам time.monotonic().
+
+    В Linux определяется по /proc и включает запуск интерпретатора и импорт
+    модулей; в остальных системах - момент импорта этого модуля.
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            seconds_since_boot = float(uptime.read().split()[0])
+        return time.monotonic() - (seconds_since_boot - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+
+# Время запуска процесса и длительность этапов запуска (в секундах от него)
+PROCESS_STARTED = _process_started()
+startup_stages = {}
+
+# Отметка завершения этапа запуска в логе и метрике bot_startup_seconds
+def mark_startup(stage):
+    startup_stages[stage] = time.monotonic() - PROCESS_STARTED
+    logger.info("Запуск: %s через %.3f с после старта процесса", stage, startup_stages[stage])
 
 # Состояния для ConversationHandler при редактировании задачи
 EDIT_TASK_ID, EDIT_TASK_TEXT, EDIT_TASK_DUE_DATE = range(3)
 
-# Функция для отправки напоминания
-async def send_reminder(user_id: int, text: str):
-    try:
-        await application.bot.send_message(user_id, f"Напоминание: {text}")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания: {e}")
+# Очередь исходящих сообщений с учётом лимитов Telegram
+send_queue = SendQueue()
+
+# Ответ на сообщение пользователя через очередь отправки
+async def reply(message, text, **kwargs):
+    return await send_queue.send(message.chat_id, lambda: message.reply_text(text, **kwargs))
+
+# Изменение сообщения с inline кнопками через очередь отправки
+async def edit(query, text, **kwargs):
+    return await send_queue.send(query.message.chat_id, lambda: query.edit_message_text(text, **kwargs))
+
+# Обработка результата отправки напоминания: учёт задержки относительно сроков задач.
+# result получает True, если напоминание доставлено или его нельзя доставить в принципе
+# (бот заблокирован, чат удалён), и False, если отправку нужно повторить позже.
+def _reminder_sent(future, due_dates, result):
+    if future.cancelled():
+        result.set_result(False)
+        return
+    error = future.exception()
+    if error is None:
+        now = datetime.now()
+        for due_date in due_dates:
+            REMINDER_LAG.observe(max((now - due_date).total_seconds(), 0))
+        result.set_result(True)
+        return
+    logger.error("Ошибка при отправке напоминания: %s", error)
+    result.set_result(isinstance(error, (Forbidden, BadRequest)))
+
+# Функция для отправки сообщения с напоминанием (или сводкой напоминаний) о задачах со сроками due_dates;
+# возвращает future с признаком доставки
+async def send_reminder(user_id: int, text: str, due_dates: list):
+    result = asyncio.get_running_loop().create_future()
+    future = send_queue.submit(
+        user_id,
+        lambda: application.bot.send_message(user_id, text),
+        priority=PRIORITY_REMINDER,
+    )
+    future.add_done_callback(lambda f: _reminder_sent(f, due_dates, result))
+    return result
+
+# Объединение напоминаний одному пользователю в сводку
+coalescer = ReminderCoalescer(send_reminder)
+if coalescer.window > 0 and coalescer.window >= REMINDER_LEASE_SECONDS:
+    # Иначе аренда истечёт, пока напоминание ждёт в сводке, и его отправит другой экземпляр
+    logger.warning(
+        "REMINDER_COALESCE_SECONDS (%s) должно быть меньше REMINDER_LEASE_SECONDS (%s).",
+        coalescer.window, REMINDER_LEASE_SECONDS,
+    )
+
+# Диспетчер напоминаний, читающий наступающие задачи из базы данных
+dispatcher = ReminderDispatcher(coalescer.submit)
+
+# HTTP-сервер с метриками в формате Prometheus и проверками /healthz и /readyz
+metrics_server = MetricsServer()
+
+# Проверка живости: процесс отвечает, цикл событий не заблокирован
+metrics_server.routes["/healthz"] = lambda: (200, "ok\n")
+
+# Проверка готовности: запуск завершён и обновления принимаются; при остановке
+# application.running сбрасывается сразу, до обработки оставшихся обновлений
+def readiness():
+    if application is None or not application.running or "ready" not in startup_stages:
+        return 503, "not ready\n"
+    return 200, "ready\n"
+
+metrics_server.routes["/readyz"] = readiness
+
+# Метрики, вычисляемые при каждом чтении /metrics
+Gauge(
+    "bot_db_pool_connections", "Соединения пула по состоянию", ["state"],
+    callback=lambda: {("in_use",): pool_stats()["in_use"], ("idle",): pool_stats()["idle"]},
+)
+Gauge(
+    "bot_db_pool_wait_seconds_max", "Максимальное ожидание соединения из пула",
+    callback=lambda: pool_stats()["wait_max"],
+)
+Gauge(
+    "bot_db_pool_acquired_total", "Количество выданных соединений из пула",
+    callback=lambda: pool_stats()["acquired"],
+)
+Gauge(
+    "bot_reminders_pending", "Напоминания в памяти диспетчера (в пределах горизонта)",
+    callback=lambda: dispatcher.pending,
+)
+Gauge(
+    "bot_send_queue_depth", "Сообщения в очереди отправки по приоритету", ["lane"],
+    callback=lambda: {
+        ("interactive",): send_queue.stats()["depth_interactive"],
+        ("reminder",): send_queue.stats()["depth_reminder"],
+        ("deferred",): send_queue.stats()["deferred"],
+    },
+)
+Gauge(
+    "bot_send_latency_seconds_avg", "Средняя задержка отправки сообщения",
+    callback=lambda: send_queue.stats()["latency_avg"],
+)
+Gauge(
+    "bot_reminders_coalescing", "Напоминания, ожидающие отправки в сводке",
+    callback=lambda: coalescer.pending,
+)
+Gauge(
+    "bot_startup_seconds", "Длительность этапов запуска от старта процесса", ["stage"],
+    callback=lambda: {(stage,): seconds for stage, seconds in startup_stages.items()},
+)
+Gauge(
+    "bot_task_cache_users", "Пользователи, задачи которых находятся в кэше",
+    callback=lambda: len(task_cache),
+)
 
 # Постоянная inline клавиатура
 def main_menu_keyboard():
@@ -65,7 +232,8 @@ def main_menu_keyboard():
 
 # Команда /start
 async def start(update: Update, context: CallbackContext):
-    await update.message.reply_text(
+    await reply(
+        update.message,
         "Привет! Я бот-напоминалка. Выберите действие ниже:",
         reply_markup=main_menu_keyboard()
     )
@@ -78,19 +246,36 @@ async def help_command(update: Update, context: CallbackContext):
         "/help - Помощь\n"
         "/add - Добавление задачи\n"
         "/tasks - Показать все задачи\n"
+        "/search - Поиск задач: '/search молоко', '/search отчёт неделя', '/search просроченные'\n"
         "/edit - Редактировать задачу\n"
-        "/delete - Удалить задачу\n\n"
+        "/delete - Удалить задачи: '/delete 12 15 18-25'\n"
+        "/done - Отметить задачи выполненными: '/done 12 15'\n"
+        "/history - Архив сработавших и выполненных задач\n"
+        "/stats - Статистика задач\n"
+        "/postpone - Перенести задачи: '/postpone 12 15 через 1 день' или '/postpone все просроченные через 2 часа'\n"
+        "/export - Выгрузить задачи файлом (csv или json)\n"
+        "/import - Загрузить задачи из файла (отправьте файл с подписью /import)\n\n"
         "Добавление задачи:\n"
         "Например:\n"
         "'/add 2024-12-05 14:30 Купить продукты'\n"
+        "'/add завтра в 9 Позвонить маме'\n"
+        "'/add в пятницу 18:00 Забрать посылку'\n"
+        "'/add 05.12 14:30 Отчёт'\n"
         "Или через время:\n"
         "'/add через 30 минут Проверить почту'\n"
-        "Поддерживаемые единицы времени: секунды, минуты, часы, дни, недели, месяцы, годы"
+        "Поддерживаемые единицы времени: секунды, минуты, часы, дни, недели, месяцы, годы\n\n"
+        "Повторяющаяся задача:\n"
+        "'/add каждый день 09:00 Зарядка'\n"
+        "'/add каждый понедельник 10:00 Планёрка'\n"
+        "'/add каждый месяц 12:00 Оплатить счета'\n"
+        "Периоды: день, неделю, месяц, год или день недели.\n"
+        "Или по расписанию cron (мин час день месяц день_недели):\n"
+        "'/add cron 0 9 * * 1-5 Проверить почту'"
     )
     # Определяем источник обновления
     message = update.message or (update.callback_query.message if update.callback_query else None)
     if message:
-        await message.reply_text(help_text)
+        await reply(message, help_text)
 
 # Callback обработчик для inline кнопок меню
 async def main_menu_callback(update: Update, context: CallbackContext):
@@ -99,16 +284,18 @@ async def main_menu_callback(update: Update, context: CallbackContext):
     data = query.data
 
     if data == 'add_task':
-        await query.edit_message_text(
-            text="Введите задачу в формате:\n'/add <дата> <время> <текст>'\nили\n'/add через <количество> <единица времени> <текст>'\n\nПоддерживаемые единицы времени: секунды, минуты, часы, дни, недели, месяцы, годы"
+        await edit(
+            query,
+            text="Введите задачу в формате:\n'/add <срок> <текст>'\n\nСрок: '2024-12-05 14:30', '05.12 14:30', 'завтра в 9', 'в пятницу 18:00', '14:30' или 'через 2 часа'"
         )
     elif data == 'view_tasks':
         await show_tasks_command(update, context)
     elif data == 'edit_task':
-        await query.edit_message_text(text="Введите ID задачи, которую хотите отредактировать:")
+        await edit(query, text="Введите ID задачи, которую хотите отредактировать:")
         return EDIT_TASK_ID
     elif data == 'delete_task':
-        await query.edit_message_text(
+        await edit(
+            query,
             text="Введите ID задачи, которую хотите удалить:\nИспользуйте команду '/delete <ID>'"
         )
     elif data == 'help':
@@ -117,225 +304,652 @@ async def main_menu_callback(update: Update, context: CallbackContext):
 
 
 # Функция для добавления задачи через команду /add
+@timed_handler
 async def add_task_command(update: Update, context: CallbackContext):
     try:
         user_id = update.message.from_user.id
         args = context.args
 
         if not args:
-            await update.message.reply_text("Пожалуйста, предоставьте детали задачи. Используйте /help для справки.")
+            await reply(update.message, "Пожалуйста, предоставьте детали задачи. Используйте /help для справки.")
             return
 
         # Определение типа задачи
-        if args[0].lower() in ['через', 'через-']:
-            if len(args) < 4:
-                await update.message.reply_text("Недостаточно аргументов для создания задачи. Используйте /help для справки.")
-                return
-            time_value = int(args[1])
-            unit = args[2].lower()
-            text = " ".join(args[3:])
-
-            # Определение единицы времени
-            units = {
-                'секунды': 'seconds',
-                'секунду': 'seconds',
-                'секунд': 'seconds',
-                'минуты': 'minutes',
-                'минуту': 'minutes',
-                'минут': 'minutes',
-                'часа': 'hours',
-                'час': 'hours',
-                'часов': 'hours',
-                'дни': 'days',
-                'день': 'days',
-                'дней': 'days',
-                'недели': 'weeks',
-                'неделю': 'weeks',
-                'недель': 'weeks',
-                'месяцы': 'months',
-                'месяц': 'months',
-                'месяцев': 'months',
-                'годы': 'years',
-                'год': 'years',
-                'лет': 'years'
-            }
-
-            if unit not in units:
-                await update.message.reply_text("Ошибка: Неверная единица времени.\nПоддерживаемые единицы: секунды, минуты, часы, дни, недели, месяцы, годы.")
-                return
-
-            unit_key = units[unit]
-
-            # Создание delta
-            if unit_key in ['seconds', 'minutes', 'hours', 'days', 'weeks']:
-                delta = timedelta(**{unit_key: time_value})
-            elif unit_key in ['months', 'years']:
-                delta = relativedelta(**{unit_key: time_value})
-            else:
-                await update.message.reply_text("Ошибка: Неверная единица времени.")
+        recurrence = None
+        if is_recurring(args):
+            # Повторяющаяся задача хранится одной строкой с правилом и ближайшим сроком
+            try:
+                recurrence, due_date, text = parse_recurrence(args, datetime.now())
+            except ValueError as e:
+                await reply(update.message, f"Ошибка: {e}")
                 return
 
-            due_date = datetime.now() + delta
-
         else:
-            if len(args) < 3:
-                await update.message.reply_text("Недостаточно аргументов для создания задачи. Используйте /help для справки.")
-                return
-            date_str = args[0]
-            time_str = args[1]
-            text = " ".join(args[2:])
+            # Срок в начале аргументов, остальное - текст задачи
             try:
-                due_date = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-            except ValueError:
-                await update.message.reply_text("Неверный формат даты или времени. Используйте YYYY-MM-DD HH:MM.")
+                due_date, consumed = parse_due(args, datetime.now())
+            except ValueError as e:
+                await reply(update.message, f"Ошибка: {e}")
+                return
+            text = " ".join(args[consumed:])
+            if not text:
+                await reply(update.message, "Недостаточно аргументов для создания задачи. Используйте /help для справки.")
                 return
 
         # Создание задачи в базе данных
-        task_id = await create_task(user_id, text, due_date)
+        task_id = await create_task(user_id, text, due_date, recurrence)
 
         # Настройка напоминания
-        trigger = DateTrigger(run_date=due_date)
-        scheduler.add_job(send_reminder, trigger, args=[user_id, text], id=str(task_id))
-        logger.info(f"Задача добавлена: {text} на {due_date.strftime('%d-%m-%Y %H:%M')} с ID {task_id}")
+        dispatcher.notify(task_id, due_date)
+        logger.info("Задача добавлена: %s на %s с ID %s", redact(text), due_date.strftime('%d-%m-%Y %H:%M'), task_id)
 
-        await update.message.reply_text(f"Задача добавлена: {text} на {due_date.strftime('%d-%m-%Y %H:%M')}")
+        if recurrence:
+            await reply(
+                update.message,
+                f"Повторяющаяся задача добавлена: {text}, {describe(recurrence)}.\n"
+                f"Ближайшее напоминание: {due_date.strftime('%d-%m-%Y %H:%M')}"
+            )
+        else:
+            await reply(update.message, f"Задача добавлена: {text} на {due_date.strftime('%d-%m-%Y %H:%M')}")
     except Exception as e:
-        logger.error(f"Ошибка при добавлении задачи: {e}")
-        await update.message.reply_text("Ошибка при добавлении задачи. Попробуйте снова.")
+        logger.error("Ошибка при добавлении задачи: %s", e)
+        await reply(update.message, "Ошибка при добавлении задачи. Попробуйте снова.")
+
+# Количество задач на одной странице списка
+TASKS_PAGE_SIZE = int(os.getenv("TASKS_PAGE_SIZE", "10"))
+# Максимальная длина текста задачи в списке
+TASK_PREVIEW_LENGTH = 300
+
+_CURSOR_EPOCH = datetime(1970, 1, 1)
+
+# Кодирование ключа (due_date, id) для callback_data
+def encode_cursor(due_date, task_id):
+    return f"{(due_date - _CURSOR_EPOCH) // timedelta(microseconds=1)}:{task_id}"
+
+# Декодирование ключа (due_date, id) из callback_data
+def decode_cursor(value):
+    micros, task_id = value.split(':')
+    return _CURSOR_EPOCH + timedelta(microseconds=int(micros)), int(task_id)
+
+# Текст задач и кнопки редактирования и удаления для списка или результатов поиска
+def format_tasks(tasks):
+    lines = []
+    keyboard = []
+    for task_id, text, due_date, recurrence in tasks:
+        if len(text) > TASK_PREVIEW_LENGTH:
+            text = text[:TASK_PREVIEW_LENGTH] + "…"
+        line = f"ID: {task_id}\nТекст: {text}\nДо: {due_date.strftime('%d-%m-%Y %H:%M')}"
+        if recurrence:
+            line += f"\nПовтор: {describe(recurrence)}"
+        lines.append(line)
+        keyboard.append([
+            InlineKeyboardButton(f"Редактировать {task_id}", callback_data=f'edit_{task_id}'),
+            InlineKeyboardButton(f"Удалить {task_id}", callback_data=f'delete_{task_id}')
+        ])
+    return lines, keyboard
+
+# Формирование текста и клавиатуры одной страницы списка задач
+async def render_tasks_page(user_id, after=None, before=None):
+    rows = await get_tasks_page(user_id, TASKS_PAGE_SIZE + 1, after=after, before=before)
+    if before is not None:
+        has_prev = len(rows) > TASKS_PAGE_SIZE
+        has_next = True
+        tasks = rows[-TASKS_PAGE_SIZE:]
+    else:
+        has_prev = after is not None
+        has_next = len(rows) > TASKS_PAGE_SIZE
+        tasks = rows[:TASKS_PAGE_SIZE]
+
+    if not tasks:
+        if after is not None or before is not None:
+            # Задачи на странице были удалены - возвращаемся к началу списка
+            return await render_tasks_page(user_id)
+        return "У вас нет задач.", None
+
+    lines, keyboard = format_tasks(tasks)
+
+    navigation = []
+    if has_prev:
+        first = tasks[0]
+        navigation.append(InlineKeyboardButton("« Назад", callback_data=f"tasks:p:{encode_cursor(first['due_date'], first['id'])}"))
+    if has_next:
+        last = tasks[-1]
+        navigation.append(InlineKeyboardButton("Вперёд »", callback_data=f"tasks:n:{encode_cursor(last['due_date'], last['id'])}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    return "\n\n".join(lines), InlineKeyboardMarkup(keyboard)
 
 # Функция для отображения задач
+@timed_handler
 async def show_tasks_command(update: Update, context: CallbackContext):
+    # Определяем источник обновления
+    message = update.message or (update.callback_query.message if update.callback_query else None)
     try:
         user_id = update.effective_user.id
-        tasks = await get_tasks(user_id)
+        text, reply_markup = await render_tasks_page(user_id)
+        if message:
+            await reply(message, text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Ошибка при отображении задач: %s", e)
+        if message:
+            await reply(message, "Ошибка при отображении задач. Попробуйте снова.")
+
+# Переключение страниц списка задач с изменением того же сообщения
+@timed_handler
+async def tasks_page_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    try:
+        _, direction, cursor = query.data.split(':', 2)
+        cursor = decode_cursor(cursor)
+        if direction == 'n':
+            text, reply_markup = await render_tasks_page(update.effective_user.id, after=cursor)
+        else:
+            text, reply_markup = await render_tasks_page(update.effective_user.id, before=cursor)
+        await edit(query, text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Ошибка при переключении страницы задач: %s", e)
+        await edit(query, "Ошибка при отображении задач. Попробуйте снова.")
+
+# Фильтры /search по сроку задачи
+SEARCH_FILTERS = {
+    'просроченные': 'overdue',
+    'overdue': 'overdue',
+    'сегодня': 'today',
+    'today': 'today',
+    'неделя': 'week',
+    'неделю': 'week',
+    'week': 'week',
+}
+
+# Длина запроса в заголовке результатов, чтобы ответ не превышал лимит Telegram
+SEARCH_TITLE_QUERY_LENGTH = 50
+
+SEARCH_FILTER_NAMES = {'overdue': "просроченные", 'today': "на сегодня", 'week': "на этой неделе"}
+
+# Диапазон сроков [от, до) для фильтра /search
+def search_due_range(search_filter, now):
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if search_filter == 'overdue':
+        return None, now
+    if search_filter == 'today':
+        return today, today + timedelta(days=1)
+    if search_filter == 'week':
+        monday = today - timedelta(days=today.weekday())
+        return monday, monday + timedelta(weeks=1)
+    return None, None
+
+# Формирование страницы результатов поиска; поиск хранится в user_data, в кнопках - только смещение
+async def render_search_page(user_id, search, offset=0):
+    due_from, due_to = search_due_range(search['filter'], datetime.now())
+    rows = await search_tasks(user_id, search['query'], TASKS_PAGE_SIZE + 1, offset, due_from, due_to)
+    tasks = rows[:TASKS_PAGE_SIZE]
+    title = "Поиск"
+    if search['query']:
+        query = search['query']
+        if len(query) > SEARCH_TITLE_QUERY_LENGTH:
+            query = query[:SEARCH_TITLE_QUERY_LENGTH] + "…"
+        title += f" «{query}»"
+    if search['filter']:
+        title += f", {SEARCH_FILTER_NAMES[search['filter']]}"
+    if not tasks:
+        return f"{title}: ничего не найдено.", None
 
-        # Определяем источник обновления
-        message = update.message or (update.callback_query.message if update.callback_query else None)
+    lines, keyboard = format_tasks(tasks)
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton("« Назад", callback_data=f"search:{max(offset - TASKS_PAGE_SIZE, 0)}"))
+    if len(rows) > TASKS_PAGE_SIZE:
+        navigation.append(InlineKeyboardButton("Вперёд »", callback_data=f"search:{offset + TASKS_PAGE_SIZE}"))
+    if navigation:
+        keyboard.append(navigation)
+    header = f"{title}: задачи {offset + 1}-{offset + len(tasks)}"
+    return header + "\n\n" + "\n\n".join(lines), InlineKeyboardMarkup(keyboard)
 
-        if not tasks:
-            if message:
-                await message.reply_text("У вас нет задач.")
+# Функция для поиска задач через команду /search <запрос> [просроченные|сегодня|неделя]
+@timed_handler
+async def search_command(update: Update, context: CallbackContext):
+    try:
+        words = []
+        search_filter = None
+        for arg in context.args:
+            if arg.lower() in SEARCH_FILTERS:
+                search_filter = SEARCH_FILTERS[arg.lower()]
+            else:
+                words.append(arg)
+        query = " ".join(words)
+        if not query and not search_filter:
+            await reply(
+                update.message,
+                "Используйте: '/search <текст>', например '/search молоко'.\n"
+                "Фильтры по сроку: просроченные, сегодня, неделя - '/search отчёт неделя'."
+            )
             return
+        search = {'query': query, 'filter': search_filter}
+        context.user_data['search'] = search
+        text, reply_markup = await render_search_page(update.effective_user.id, search)
+        await reply(update.message, text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Ошибка при поиске задач: %s", e)
+        await reply(update.message, "Ошибка при поиске задач. Попробуйте снова.")
 
-        for task in tasks:
-            task_id, text, due_date = task
-            due_date_formatted = due_date.strftime("%d-%m-%Y %H:%M")
-            keyboard = [
-                [
-                    InlineKeyboardButton("Редактировать", callback_data=f'edit_{task_id}'),
-                    InlineKeyboardButton("Удалить", callback_data=f'delete_{task_id}')
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            if message:
-                await message.reply_text(
-                    f"ID: {task_id}\nТекст: {text}\nДо: {due_date_formatted}",
-                    reply_markup=reply_markup
-                )
+# Переключение страниц результатов поиска
+@timed_handler
+async def search_page_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    try:
+        search = context.user_data.get('search')
+        if search is None:
+            await edit(query, "Результаты поиска устарели. Повторите /search.")
+            return
+        offset = int(query.data.split(':', 1)[1])
+        text, reply_markup = await render_search_page(update.effective_user.id, search, offset)
+        await edit(query, text, reply_markup=reply_markup)
     except Exception as e:
-        logger.error(f"Ошибка при отображении задач: {e}")
-        message = update.message or (update.callback_query.message if update.callback_query else None)
-        if message:
-            await message.reply_text("Ошибка при отображении задач. Попробуйте снова.")
+        logger.error("Ошибка при переключении страницы поиска: %s", e)
+        await edit(query, "Ошибка при поиске задач. Попробуйте снова.")
+
+# Максимальное количество задач в одной пакетной операции
+BATCH_MAX_IDS = 1000
+# Максимальное количество ID и строк в итоговом сообщении пакетной операции
+BATCH_SUMMARY_ITEMS = 20
+# Слова для выбора всех просроченных задач в /postpone
+OVERDUE_WORDS = ('все просроченные', 'просроченные', 'all overdue', 'overdue')
+
+# Разбор списка ID задач вида '12 15 18-25' (допускаются и запятые)
+def parse_task_ids(args):
+    task_ids = []
+    for token in re.split(r'[\s,]+', " ".join(args).strip()):
+        if not token:
+            continue
+        match = re.fullmatch(r'(\d+)(?:-(\d+))?', token)
+        if not match:
+            raise ValueError(f"Неверный ID задачи: {token}")
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        if start > end:
+            raise ValueError(f"Неверный диапазон: {token}")
+        if len(task_ids) + end - start + 1 > BATCH_MAX_IDS:
+            raise ValueError(f"За один раз можно указать не более {BATCH_MAX_IDS} задач.")
+        task_ids.extend(range(start, end + 1))
+    if not task_ids:
+        raise ValueError("Не указаны ID задач.")
+    # Повторы убираются с сохранением порядка
+    return list(dict.fromkeys(task_ids))
 
-# Функция для удаления задачи через команду /delete
+# Краткая запись списка ID для итогового сообщения
+def format_ids(task_ids):
+    shown = ", ".join(str(task_id) for task_id in task_ids[:BATCH_SUMMARY_ITEMS])
+    if len(task_ids) > BATCH_SUMMARY_ITEMS:
+        shown += f" и ещё {len(task_ids) - BATCH_SUMMARY_ITEMS}"
+    return shown
+
+# Функция для удаления задач через команду /delete <ID> [ID ...] [от-до]
+@timed_handler
 async def delete_task_command(update: Update, context: CallbackContext):
     try:
         args = context.args
         if not args:
-            await update.message.reply_text("Пожалуйста, укажите ID задачи для удаления. Используйте /help для справки.")
+            await reply(update.message, "Пожалуйста, укажите ID задачи для удаления. Используйте /help для справки.")
+            return
+
+        try:
+            task_ids = parse_task_ids(args)
+        except ValueError as e:
+            await reply(update.message, f"Ошибка: {e}")
+            return
+        user_id = update.effective_user.id
+
+        deleted = await delete_tasks(user_id, task_ids)
+        dispatcher.discard(*deleted)
+
+        if len(task_ids) == 1:
+            if deleted:
+                await reply(update.message, f"Задача {task_ids[0]} удалена.")
+            else:
+                await reply(update.message, f"Задача с ID {task_ids[0]} не найдена.")
+            return
+
+        deleted_set = set(deleted)
+        missing = [task_id for task_id in task_ids if task_id not in deleted_set]
+        lines = [f"Удалено задач: {len(deleted)}" + (f" ({format_ids(sorted(deleted))})" if deleted else "")]
+        if missing:
+            lines.append(f"Не найдены: {format_ids(missing)}")
+        await reply(update.message, "\n".join(lines))
+    except Exception as e:
+        logger.error("Ошибка при удалении задачи: %s", e)
+        await reply(update.message, "Ошибка при удалении задачи. Попробуйте снова.")
+
+# Функция для переноса задач через команду /postpone <ID ...|все просроченные> через <количество> <единица>
+@timed_handler
+async def postpone_command(update: Update, context: CallbackContext):
+    usage = (
+        "Используйте: '/postpone 12 15 18-25 через 1 день' "
+        "или '/postpone все просроченные через 2 часа'"
+    )
+    try:
+        args = [arg.lower() for arg in context.args]
+        if 'через' not in args:
+            await reply(update.message, usage)
+            return
+        split = args.index('через')
+        target, interval = args[:split], args[split + 1:]
+        if not target or not interval:
+            await reply(update.message, usage)
+            return
+
+        try:
+            task_ids = None if " ".join(target) in OVERDUE_WORDS else parse_task_ids(target)
+            months, seconds, consumed = parse_interval(interval)
+        except ValueError as e:
+            await reply(update.message, f"Ошибка: {e}")
+            return
+        if consumed != len(interval) or (months <= 0 and seconds <= 0):
+            await reply(update.message, usage)
             return
 
-        task_id = int(args[0])
         user_id = update.effective_user.id
-        tasks = await get_tasks(user_id)
+        postponed = await postpone_tasks(user_id, datetime.now(), months, seconds, task_ids)
+        if postponed is None:
+            await reply(update.message, "Ошибка при переносе задач. Попробуйте снова.")
+            return
+        dispatcher.notify_many(postponed)
 
-        if not any(task[0] == task_id for task in tasks):
-            await update.message.reply_text(f"Задача с ID {task_id} не найдена.")
+        if not postponed:
+            await reply(update.message, "Нет задач для переноса.")
             return
+        postponed.sort(key=lambda item: item[1])
+        lines = [f"Перенесено задач: {len(postponed)}"]
+        for task_id, due_date in postponed[:BATCH_SUMMARY_ITEMS]:
+            lines.append(f"ID {task_id}: до {due_date.strftime('%d-%m-%Y %H:%M')}")
+        if len(postponed) > BATCH_SUMMARY_ITEMS:
+            lines.append(f"… и ещё {len(postponed) - BATCH_SUMMARY_ITEMS}")
+        if task_ids is not None:
+            found = {task_id for task_id, _ in postponed}
+            missing = [task_id for task_id in task_ids if task_id not in found]
+            if missing:
+                lines.append(f"Не найдены: {format_ids(missing)}")
+        await reply(update.message, "\n".join(lines))
+    except Exception as e:
+        logger.error("Ошибка при переносе задач: %s", e)
+        await reply(update.message, "Ошибка при переносе задач. Попробуйте снова.")
 
-        await delete_task(task_id)
-        scheduler.remove_job(str(task_id))
-        logger.info(f"Задача с ID {task_id} удалена.")
+# Функция для отметки задач выполненными через команду /done <ID> [ID ...] [от-до]
+@timed_handler
+async def done_command(update: Update, context: CallbackContext):
+    try:
+        if not context.args:
+            await reply(update.message, "Пожалуйста, укажите ID выполненных задач, например '/done 12 15'.")
+            return
+        try:
+            task_ids = parse_task_ids(context.args)
+        except ValueError as e:
+            await reply(update.message, f"Ошибка: {e}")
+            return
 
-        await update.message.reply_text(f"Задача {task_id} удалена.")
-    except ValueError:
-        await update.message.reply_text("ID задачи должен быть числом.")
+        result = await complete_tasks(update.effective_user.id, task_ids, datetime.now())
+        if result is None:
+            await reply(update.message, "Ошибка при отметке задач. Попробуйте снова.")
+            return
+        done, advanced = result
+        dispatcher.discard(*done)
+        dispatcher.notify_many(advanced)
+
+        found = set(done) | {task_id for task_id, _ in advanced}
+        missing = [task_id for task_id in task_ids if task_id not in found]
+        lines = []
+        if done:
+            lines.append(f"Выполнено и перенесено в архив: {format_ids(sorted(done))}")
+        for task_id, due_date in advanced[:BATCH_SUMMARY_ITEMS]:
+            lines.append(f"Повторяющаяся задача {task_id} выполнена, следующее напоминание: {due_date.strftime('%d-%m-%Y %H:%M')}")
+        if missing:
+            lines.append(f"Не найдены: {format_ids(missing)}")
+        await reply(update.message, "\n".join(lines))
+    except Exception as e:
+        logger.error("Ошибка при отметке задач: %s", e)
+        await reply(update.message, "Ошибка при отметке задач. Попробуйте снова.")
+
+# Состояния задач в архиве
+HISTORY_STATUSES = {'fired': "напоминание отправлено", 'done': "выполнена"}
+
+# Формирование страницы архива задач, от новых к старым
+async def render_history_page(user_id, before=None):
+    rows = await get_history_page(user_id, TASKS_PAGE_SIZE + 1, before=before)
+    tasks = rows[:TASKS_PAGE_SIZE]
+    if not tasks:
+        return ("Архив пуст." if before is None else "Более старых задач в архиве нет."), None
+
+    lines = []
+    for task in tasks:
+        text = task['text']
+        if len(text) > TASK_PREVIEW_LENGTH:
+            text = text[:TASK_PREVIEW_LENGTH] + "…"
+        status = HISTORY_STATUSES.get(task['status'], task['status'])
+        line = (
+            f"ID: {task['id']}\nТекст: {text}\nСрок: {task['due_date'].strftime('%d-%m-%Y %H:%M')}\n"
+            f"{status.capitalize()}: {task['archived_at'].strftime('%d-%m-%Y %H:%M')}"
+        )
+        if task['recurrence']:
+            line += f"\nПовтор: {describe(task['recurrence'])}"
+        lines.append(line)
+
+    keyboard = []
+    if len(rows) > TASKS_PAGE_SIZE:
+        last = tasks[-1]
+        keyboard.append([InlineKeyboardButton(
+            "Старее »", callback_data=f"history:{encode_cursor(last['due_date'], last['id'])}"
+        )])
+    return "\n\n".join(lines), InlineKeyboardMarkup(keyboard) if keyboard else None
+
+# Функция для просмотра архива сработавших и выполненных задач через команду /history
+@timed_handler
+async def history_command(update: Update, context: CallbackContext):
+    try:
+        text, reply_markup = await render_history_page(update.effective_user.id)
+        await reply(update.message, text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Ошибка при отображении архива: %s", e)
+        await reply(update.message, "Ошибка при отображении архива. Попробуйте снова.")
+
+# Переключение страниц архива задач
+@timed_handler
+async def history_page_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    try:
+        cursor = decode_cursor(query.data.split(':', 1)[1])
+        text, reply_markup = await render_history_page(update.effective_user.id, before=cursor)
+        await edit(query, text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error("Ошибка при переключении страницы архива: %s", e)
+        await edit(query, "Ошибка при отображении архива. Попробуйте снова.")
+
+# Функция для просмотра статистики задач через команду /stats
+@timed_handler
+async def stats_command(update: Update, context: CallbackContext):
+    try:
+        user_id = update.effective_user.id
+        now = datetime.now()
+        stats = await get_user_stats(user_id, now)
+        if stats is None:
+            await reply(update.message, "Ошибка при получении статистики. Попробуйте снова.")
+            return
+        text = (
+            "Ваши задачи:\n"
+            f"Открытых: {stats['open_count']}\n"
+            f"Просроченных: {stats['overdue']}\n"
+            f"На сегодня: {stats['due_today']}\n"
+            f"Выполнено за неделю: {stats['done_week']}"
+        )
+        if user_id in ADMIN_IDS:
+            total = await get_global_stats(now)
+            if total is not None:
+                text += (
+                    "\n\nВсе пользователи:\n"
+                    f"Пользователей с задачами: {total['users']}\n"
+                    f"Открытых: {total['open_count']}\n"
+                    f"Просроченных: {total['overdue']}\n"
+                    f"На сегодня: {total['due_today']}\n"
+                    f"Выполнено за неделю: {total['done_week']}"
+                )
+        await reply(update.message, text)
     except Exception as e:
-        logger.error(f"Ошибка при удалении задачи: {e}")
-        await update.message.reply_text("Ошибка при удалении задачи. Попробуйте снова.")
+        logger.error("Ошибка при отображении статистики: %s", e)
+        await reply(update.message, "Произошла ошибка. Попробуйте снова.")
+
+# Удаление данных завершённого редактирования, чтобы они не сохранялись в базе
+def clear_edit_state(context):
+    context.user_data.pop('edit_task_id', None)
+    context.user_data.pop('edit_task_text', None)
 
 # Редактирование задачи: шаг 1 - ввод ID
+@timed_handler
 async def edit_task_id(update: Update, context: CallbackContext):
     try:
         task_id = int(update.message.text)
         user_id = update.effective_user.id
-        tasks = await get_tasks(user_id)
 
-        if not any(task[0] == task_id for task in tasks):
-            await update.message.reply_text(f"Задача с ID {task_id} не найдена.")
+        if await get_task(user_id, task_id) is None:
+            await reply(update.message, f"Задача с ID {task_id} не найдена.")
             return ConversationHandler.END
 
         context.user_data['edit_task_id'] = task_id
-        await update.message.reply_text("Введите новый текст задачи:")
+        await reply(update.message, "Введите новый текст задачи:")
         return EDIT_TASK_TEXT
     except ValueError:
-        await update.message.reply_text("ID задачи должен быть числом. Пожалуйста, введите корректный ID:")
+        await reply(update.message, "ID задачи должен быть числом. Пожалуйста, введите корректный ID:")
         return EDIT_TASK_ID
     except Exception as e:
-        logger.error(f"Ошибка при вводе ID задачи для редактирования: {e}")
-        await update.message.reply_text("Произошла ошибка. Попробуйте снова.")
+        logger.error("Ошибка при вводе ID задачи для редактирования: %s", e)
+        await reply(update.message, "Произошла ошибка. Попробуйте снова.")
         return ConversationHandler.END
 
 # Редактирование задачи: шаг 2 - ввод нового текста
+@timed_handler
 async def edit_task_text(update: Update, context: CallbackContext):
     try:
         new_text = update.message.text
         context.user_data['edit_task_text'] = new_text
-        await update.message.reply_text("Введите новую дату и время выполнения задачи (YYYY-MM-DD HH:MM):")
+        await reply(update.message, "Введите новый срок задачи, например '2024-12-05 14:30', 'завтра в 9' или 'через 2 часа':")
         return EDIT_TASK_DUE_DATE
     except Exception as e:
-        logger.error(f"Ошибка при вводе нового текста задачи: {e}")
-        await update.message.reply_text("Произошла ошибка. Попробуйте снова.")
+        logger.error("Ошибка при вводе нового текста задачи: %s", e)
+        await reply(update.message, "Произошла ошибка. Попробуйте снова.")
         return ConversationHandler.END
 
 # Редактирование задачи: шаг 3 - ввод новой даты и времени
+@timed_handler
 async def edit_task_due_date(update: Update, context: CallbackContext):
     try:
-        due_date_str = update.message.text
-        new_due_date = datetime.strptime(due_date_str, "%Y-%m-%d %H:%M")
+        new_due_date = parse_due_text(update.message.text, datetime.now())
         task_id = context.user_data['edit_task_id']
         new_text = context.user_data['edit_task_text']
 
-        # Обновление задачи в базе данных
-        await update_task(task_id, new_text, new_due_date)
-
-        # Обновление напоминания в планировщике
-        try:
-            scheduler.remove_job(str(task_id))
-        except Exception as e:
-            logger.warning(f"Не удалось удалить существующее задание из планировщика: {e}")
+        # Обновление задачи в базе данных с проверкой владельца
+        if await update_task(update.effective_user.id, task_id, new_text, new_due_date) is None:
+            await reply(update.message, f"Задача с ID {task_id} не найдена.")
+            return ConversationHandler.END
 
-        trigger = DateTrigger(run_date=new_due_date)
-        scheduler.add_job(send_reminder, trigger, args=[update.effective_user.id, new_text], id=str(task_id))
-        logger.info(f"Задача {task_id} обновлена: {new_text} на {new_due_date.strftime('%d-%m-%Y %H:%M')}")
+        # Обновление напоминания в диспетчере
+        dispatcher.notify(task_id, new_due_date)
+        logger.info("Задача %s обновлена: %s на %s", task_id, redact(new_text), new_due_date.strftime('%d-%m-%Y %H:%M'))
+        clear_edit_state(context)
 
-        await update.message.reply_text(f"Задача {task_id} обновлена.")
+        await reply(update.message, f"Задача {task_id} обновлена.")
         return ConversationHandler.END
-    except ValueError:
-        await update.message.reply_text("Неверный формат даты или времени. Пожалуйста, введите в формате YYYY-MM-DD HH:MM:")
+    except ValueError as e:
+        await reply(update.message, f"Ошибка: {e}\nПожалуйста, введите срок ещё раз:")
         return EDIT_TASK_DUE_DATE
     except Exception as e:
-        logger.error(f"Ошибка при обновлении даты и времени задачи: {e}")
-        await update.message.reply_text("Произошла ошибка при обновлении задачи. Попробуйте снова.")
+        logger.error("Ошибка при обновлении даты и времени задачи: %s", e)
+        await reply(update.message, "Произошла ошибка при обновлении задачи. Попробуйте снова.")
         return ConversationHandler.END
 
+# Максимальный размер файла импорта (в байтах); Bot API отдаёт файлы до 20 МБ
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Размер файла экспорта/импорта, до которого он хранится в памяти, а не на диске
+TRANSFER_SPOOL_BYTES = 1024 * 1024
+
+# Функция для выгрузки задач пользователя файлом через команду /export [csv|json]
+@timed_handler
+async def export_command(update: Update, context: CallbackContext):
+    fmt = context.args[0].lower() if context.args else 'csv'
+    if fmt not in FORMATS:
+        await reply(update.message, "Поддерживаемые форматы: csv, json. Например: '/export json'")
+        return
+    user_id = update.effective_user.id
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=TRANSFER_SPOOL_BYTES) as file:
+            out = text_stream(file, encoding='utf-8')
+            count = await write_export(iter_tasks(user_id), fmt, out)
+            out.flush()
+            out.detach()
+            if not count:
+                await reply(update.message, "У вас нет задач.")
+                return
+
+            # Фабрика может быть вызвана повторно после RetryAfter, поэтому файл читается с начала
+            def send_document():
+                file.seek(0)
+                return update.message.reply_document(
+                    document=file, filename=f"tasks.{fmt}", caption=f"Задач: {count}"
+                )
+
+            await send_queue.send(update.message.chat_id, send_document)
+    except Exception as e:
+        logger.error("Ошибка при экспорте задач: %s", e)
+        await reply(update.message, "Ошибка при экспорте задач. Попробуйте снова.")
+
+# Функция для загрузки задач из файла: документ с подписью /import или /import в ответ на документ
+@timed_handler
+async def import_command(update: Update, context: CallbackContext):
+    message = update.message
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        await reply(
+            message,
+            "Отправьте файл CSV или JSON с подписью /import или ответьте командой /import на сообщение с файлом.\n"
+            "Формат файла совпадает с выгрузкой /export: столбцы text, due_date и необязательные recurrence, delivered_at."
+        )
+        return
+    fmt = detect_format(document.file_name, document.mime_type)
+    if fmt is None:
+        await reply(message, "Поддерживаются только файлы .csv и .json.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await reply(message, f"Файл слишком большой (максимум {IMPORT_MAX_BYTES // (1024 * 1024)} МБ).")
+        return
+
+    user_id = update.effective_user.id
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=TRANSFER_SPOOL_BYTES) as file:
+            telegram_file = await context.bot.get_file(document.file_id)
+            await telegram_file.download_to_memory(out=file)
+            file.seek(0)
+            chunks = iter_import_chunks(text_stream(file), fmt, datetime.now())
+            count = await import_tasks(user_id, chunks)
+    except ValueError as e:
+        await reply(message, f"Ошибка в файле: {e}\nЗадачи не импортированы.")
+        return
+    except Exception as e:
+        logger.error("Ошибка при импорте задач: %s", e)
+        await reply(message, "Ошибка при импорте задач. Попробуйте снова.")
+        return
+
+    # Напоминания по всем загруженным задачам подхватываются одним перечитыванием горизонта
+    dispatcher.refresh()
+    await reply(message, f"Импортировано задач: {count}")
+
 # Завершение редактирования задачи
 async def cancel_edit(update: Update, context: CallbackContext):
-    await update.message.reply_text("Редактирование задачи отменено.", reply_markup=main_menu_keyboard())
+    clear_edit_state(context)
+    await reply(update.message, "Редактирование задачи отменено.", reply_markup=main_menu_keyboard())
     return ConversationHandler.END
 
 # Функция обработки редактирования и удаления конкретных задач из списка
+@timed_handler
 async def task_callback(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
@@ -343,80 +957,186 @@ async def task_callback(update: Update, context: CallbackContext):
 
     if data.startswith('edit_'):
         task_id = int(data.split('_')[1])
+        if await get_task(update.effective_user.id, task_id) is None:
+            await edit(query, f"Задача с ID {task_id} не найдена.")
+            return ConversationHandler.END
+
         context.user_data['edit_task_id'] = task_id
-        await query.edit_message_text(text="Введите новый текст задачи:")
+        await edit(query, text="Введите новый текст задачи:")
         return EDIT_TASK_TEXT
     elif data.startswith('delete_'):
         task_id = int(data.split('_')[1])
         user_id = update.effective_user.id
-        tasks = await get_tasks(user_id)
 
-        if not any(task[0] == task_id for task in tasks):
-            await query.edit_message_text(f"Задача с ID {task_id} не найдена.")
+        if not await delete_task(user_id, task_id):
+            await edit(query, f"Задача с ID {task_id} не найдена.")
             return ConversationHandler.END
 
-        await delete_task(task_id)
-        try:
-            scheduler.remove_job(str(task_id))
-        except Exception as e:
-            logger.warning(f"Не удалось удалить задание {task_id} из планировщика: {e}")
-        await query.edit_message_text(f"Задача {task_id} удалена.")
+        dispatcher.discard(task_id)
+        await edit(query, f"Задача {task_id} удалена.")
     return ConversationHandler.END
 
 # Основной обработчик ошибок
 async def error_handler(update: object, context: CallbackContext):
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
+    if isinstance(context.error, TelegramError):
+        TELEGRAM_ERRORS.inc(type=type(context.error).__name__)
     if isinstance(update, Update) and update.effective_message:
-        await update.effective_message.reply_text("Произошла ошибка. Пожалуйста, попробуйте позже.")
+        await reply(update.effective_message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+
+# Признак того, что startup() уже выполнена
+_started = False
 
 # Функция запуска бота
 async def startup():
-    """Функция, выполняемая при старте бота."""
-    await create_table()
-    logger.info("База данных инициализирована.")
-
-# Инициализация бота
-application = Application.builder().token(TELEGRAM_TOKEN).build()
-
-# Регистрация обработчиков команд
-application.add_handler(CommandHandler("start", start))
-application.add_handler(CommandHandler("help", help_command))
-application.add_handler(CommandHandler("add", add_task_command))
-application.add_handler(CommandHandler("tasks", show_tasks_command))
-application.add_handler(CommandHandler("delete", delete_task_command))
-
-# Регистрация обработчика callback query для inline клавиатуры
-application.add_handler(CallbackQueryHandler(main_menu_callback))
-
-# Регистрация ConversationHandler для редактирования задачи через кнопку меню
-edit_task_conv = ConversationHandler(
-    entry_points=[CallbackQueryHandler(main_menu_callback, pattern='^edit_task$')],
-    states={
-        EDIT_TASK_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_task_id)],
-        EDIT_TASK_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_task_text)],
-        EDIT_TASK_DUE_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_task_due_date)]
-    },
-    fallbacks=[CommandHandler('cancel', cancel_edit)],
-    allow_reentry=True
-)
-application.add_handler(edit_task_conv)
+    """Запуск HTTP-сервера служебных эндпоинтов, создание пула и применение миграций.
 
+    Выполняется один раз: хранилище состояния вызывает её в Application.initialize()
+    перед загрузкой диалогов, а post_init - на случай запуска без него.
+    HTTP-сервер запускается первым, чтобы /healthz отвечал во время миграций.
+    """
+    global _started
+    if _started:
+        return
+    await metrics_server.start()
+    await init_pool()
+    await migrate()
+    _started = True
+    mark_startup("database")
 
-# Регистрация обработчика редактирования и удаления конкретных задач
-application.add_handler(CallbackQueryHandler(task_callback, pattern='^(edit_|delete_)'))
+# Подготовка к работе до начала получения обновлений
+async def post_init(application: Application):
+    await startup()
+    send_queue.start()
+    dispatcher.start()
+    application.job_queue.run_repeating(
+        maintenance_job, interval=TASK_MAINTENANCE_INTERVAL_HOURS * 3600, first=0, name="maintenance"
+    )
+    application.job_queue.run_repeating(
+        stats_reconcile_job, interval=STATS_RECONCILE_INTERVAL_HOURS * 3600, name="stats_reconcile"
+    )
+    mark_startup("ready")
 
-# Регистрация обработчика ошибок
-application.add_error_handler(error_handler)
+# Завершение отправки напоминаний после того, как обработаны все полученные обновления
+async def post_stop(application: Application):
+    await dispatcher.stop()
+    # Накопленные сводки отправляются до остановки очереди
+    await coalescer.close()
+    logger.info("Сводками сэкономлено отправок: %s", coalescer.saved)
+    await send_queue.stop()
+    # Отметка напоминаний, отправленных уже после остановки диспетчера
+    await dispatcher.flush()
+    logger.info("Статистика очереди отправки: %s", send_queue.stats())
 
-# Регистрация и запуск функции startup при старте бота
-async def on_startup(application: Application):
-    await startup()
+# Закрытие пула соединений после записи состояния диалогов (Application.shutdown())
+async def post_shutdown(application: Application):
+    # HTTP-сервер останавливается последним, чтобы /readyz отвечал 503 всё время остановки
+    await metrics_server.stop()
+    logger.info("Статистика пула соединений: %s", pool_stats())
+    await close_pool()
+
+# Экземпляр приложения, создаётся в create_application()
+application = None
+
+# Создание и настройка приложения бота
+def create_application(token=None, api_url=None):
+    global application
+    token = token or TELEGRAM_TOKEN
+    api_url = api_url or TELEGRAM_API_URL
+    if token is None:
+        raise ValueError("Не указан TELEGRAM_TOKEN в переменных окружения")
+
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(
+            UPDATE_CONCURRENCY, on_first_update=lambda: mark_startup("first_update")
+        ))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .persistence(DatabasePersistence(prepare=startup))
+    )
+    if api_url:
+        api_url = api_url.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    application = builder.build()
 
-application.job_queue.run_once(on_startup, when=0)
+    # Регистрация обработчиков команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("add", add_task_command))
+    application.add_handler(CommandHandler("tasks", show_tasks_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("delete", delete_task_command))
+    application.add_handler(CommandHandler("postpone", postpone_command))
+    application.add_handler(CommandHandler("done", done_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r'^/import(@\w+)?(\s|$)'), import_command
+    ))
+
+    # Регистрация обработчика переключения страниц списка задач
+    application.add_handler(CallbackQueryHandler(tasks_page_callback, pattern='^tasks:'))
+    application.add_handler(CallbackQueryHandler(search_page_callback, pattern=r'^search:\d+$'))
+    application.add_handler(CallbackQueryHandler(history_page_callback, pattern='^history:'))
+
+    # Регистрация обработчика callback query для inline клавиатуры
+    application.add_handler(CallbackQueryHandler(main_menu_callback, pattern='^(add_task|view_tasks|delete_task|help)$'))
+
+    # Регистрация ConversationHandler для редактирования задачи через кнопку меню или кнопку в списке
+    edit_task_conv = ConversationHandler(
+        entry_points=[
+            CallbackQueryHandler(main_menu_callback, pattern='^edit_task$'),
+            CallbackQueryHandler(task_callback, pattern=r'^edit_\d+$'),
+        ],
+        states={
+            EDIT_TASK_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_task_id)],
+            EDIT_TASK_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_task_text)],
+            EDIT_TASK_DUE_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_task_due_date)]
+        },
+        fallbacks=[CommandHandler('cancel', cancel_edit)],
+        allow_reentry=True,
+        # Состояние диалога сохраняется в базе и переживает перезапуск бота
+        name="edit_task",
+        persistent=True,
+    )
+    application.add_handler(edit_task_conv)
+
+    # Регистрация обработчика редактирования и удаления конкретных задач
+    application.add_handler(CallbackQueryHandler(task_callback, pattern=r'^delete_\d+$'))
+
+    # Регистрация обработчика ошибок
+    application.add_error_handler(error_handler)
+
+    return application
+
+# Запуск получения обновлений в выбранном режиме
+def run(application):
+    if BOT_MODE == 'webhook':
+        if WEBHOOK_URL is None:
+            raise ValueError("Не указан WEBHOOK_URL для режима webhook")
+        logger.info("Запуск в режиме webhook на %s:%s/%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+        )
+    elif BOT_MODE == 'polling':
+        application.run_polling()
+    else:
+        raise ValueError(f"Неизвестный режим BOT_MODE: {BOT_MODE}")
 
 # Основной запуск приложения
 if __name__ == '__main__':
+    setup_logging()
+    mark_startup("imported")
     try:
-        application.run_polling()
+        run(create_application())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Бот остановлен вручную.")
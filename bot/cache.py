@@ -0,0 +1,112 @@
+import itertools
+import os
+import time
+from collections import OrderedDict
+
+from metrics import TASK_CACHE_EVENTS
+
+# Количество пользователей, чьи задачи хранятся в кэше; 0 - кэш отключён
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", "1000"))
+# Время жизни записи кэша (в секундах)
+TASK_CACHE_TTL = float(os.getenv("TASK_CACHE_TTL", "60"))
+
+# Количество пользователей, для которых хранится версия их записей
+_MAX_VERSIONS = 10000
+
+
+class TaskCache:
+    """Кэш результатов чтения задач по пользователям с вытеснением LRU и TTL.
+
+    Для каждого пользователя хранится словарь {ключ запроса: результат}, поэтому
+    любое изменение задач пользователя сбрасывает все его записи разом. TTL
+    ограничивает время, в течение которого видны изменения, сделанные другими
+    экземплярами бота напрямую в базе данных.
+    """
+
+    def __init__(self, size=TASK_CACHE_SIZE, ttl=TASK_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        # user_id -> (момент истечения, {ключ запроса: результат})
+        self._users = OrderedDict()
+        # user_id -> номер последнего сброса записей пользователя; результат запроса,
+        # начатого до сброса, не сохраняется
+        self._versions = OrderedDict()
+        self._counter = itertools.count(1)
+        # Версия пользователей, чей номер вытеснен из _versions: не меньше любого вытесненного
+        self._floor = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def get(self, user_id, key):
+        """Результат запроса из кэша; (True, значение) или (False, None) при промахе."""
+        if not self.enabled:
+            return False, None
+        results = self._results(user_id)
+        if results is not None and key in results:
+            return self._hit(user_id, results[key])
+        TASK_CACHE_EVENTS.inc(event="miss")
+        return False, None
+
+    def find_task(self, user_id, task_id):
+        """Задача из любого сохранённого результата пользователя, например из страницы списка."""
+        if not self.enabled:
+            return False, None
+        results = self._results(user_id)
+        if results is not None:
+            for result in results.values():
+                for row in result if isinstance(result, list) else [result]:
+                    if row is not None and row['id'] == task_id:
+                        return self._hit(user_id, row)
+        TASK_CACHE_EVENTS.inc(event="miss")
+        return False, None
+
+    def _results(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._users[user_id]
+            return None
+        return entry[1]
+
+    def _hit(self, user_id, value):
+        self._users.move_to_end(user_id)
+        TASK_CACHE_EVENTS.inc(event="hit")
+        return True, value
+
+    def version(self, user_id):
+        """Версия записей пользователя; запоминается до запроса и передаётся в put()."""
+        return self._versions.get(user_id, self._floor)
+
+    def put(self, user_id, key, value, version):
+        """Сохранить результат запроса, выполненного при версии записей пользователя version."""
+        if not self.enabled or version != self.version(user_id):
+            return
+        entry = self._users.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            entry = self._users[user_id] = (time.monotonic() + self.ttl, {})
+        self._users.move_to_end(user_id)
+        entry[1][key] = value
+        while len(self._users) > self.size:
+            self._users.popitem(last=False)
+            TASK_CACHE_EVENTS.inc(event="eviction")
+
+    def invalidate(self, *user_ids):
+        """Сбросить записи пользователей после изменения их задач."""
+        for user_id in user_ids:
+            self._users.pop(user_id, None)
+            self._versions[user_id] = next(self._counter)
+            self._versions.move_to_end(user_id)
+        while len(self._versions) > _MAX_VERSIONS:
+            _, version = self._versions.popitem(last=False)
+            self._floor = max(self._floor, version)
+
+    def clear(self):
+        self._versions.clear()
+        self._floor = next(self._counter)
+        self._users.clear()
+
+    def __len__(self):
+        return len(self._users)
@@ -0,0 +1,301 @@
+import os
+import re
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+# Разбор срока задачи из аргументов /add, ответа в диалоге редактирования и интервала /postpone.
+# Поддерживаемые формы (регистр не важен):
+#   через 2 часа, через час, через 1 час 30 минут, in 2 hours
+#   2024-12-05 14:30, 05.12 14:30, 05.12.2024 в 9
+#   сегодня/завтра/послезавтра [в 9[:30]], today/tomorrow [at 9pm]
+#   [в] пятницу [в 18:00], [on] friday [at 6pm], пт 18:00
+#   14:30, в 9, в 9 вечера, at 9am
+# Разбор идёт по словам с поиском в таблицах и заранее скомпилированными
+# выражениями, поэтому не зависит от длины текста задачи.
+
+# Время напоминания, если указан только день
+DUE_DEFAULT_HOUR = int(os.getenv("DUE_DEFAULT_HOUR", "9"))
+
+# Единицы интервала -> (месяцев, секунд) в одной единице
+_UNIT_SIZES = {
+    'seconds': (0, 1),
+    'minutes': (0, 60),
+    'hours': (0, 3600),
+    'days': (0, 86400),
+    'weeks': (0, 7 * 86400),
+    'months': (1, 0),
+    'years': (12, 0),
+}
+
+# Все формы единиц времени
+UNITS = {
+    **dict.fromkeys((
+        'секунда', 'секунды', 'секунду', 'секунд', 'сек', 'с',
+        's', 'sec', 'secs', 'second', 'seconds',
+    ), 'seconds'),
+    **dict.fromkeys((
+        'минута', 'минуты', 'минуту', 'минут', 'мин',
+        'm', 'min', 'mins', 'minute', 'minutes',
+    ), 'minutes'),
+    **dict.fromkeys((
+        'час', 'часа', 'часов', 'часы', 'ч',
+        'h', 'hr', 'hrs', 'hour', 'hours',
+    ), 'hours'),
+    **dict.fromkeys((
+        'день', 'дня', 'дней', 'дни', 'дн', 'сутки', 'суток',
+        'd', 'day', 'days',
+    ), 'days'),
+    **dict.fromkeys((
+        'неделя', 'недели', 'неделю', 'недель', 'нед',
+        'w', 'wk', 'wks', 'week', 'weeks',
+    ), 'weeks'),
+    **dict.fromkeys((
+        'месяц', 'месяца', 'месяцев', 'месяцы', 'мес',
+        'mo', 'month', 'months',
+    ), 'months'),
+    **dict.fromkeys((
+        'год', 'года', 'лет', 'годы', 'г',
+        'y', 'yr', 'yrs', 'year', 'years',
+    ), 'years'),
+}
+
+# Единицы, которые можно указать без числа ('через час', 'in a minute' - одна единица).
+# Сокращения ('с', 'ч', 'г', 'm', 's'...) требуют числа: 'через 2 часа с Машей' - 'с' здесь предлог
+_SINGLE_UNITS = frozenset((
+    'секунду', 'секунда', 'минуту', 'минута', 'час', 'день', 'сутки', 'неделю', 'неделя', 'месяц', 'год',
+    'second', 'minute', 'hour', 'day', 'week', 'month', 'year',
+))
+
+# Количество словами: 'через пару часов', 'через две недели', 'in an hour'
+_NUMBERS = {
+    'один': 1, 'одну': 1, 'одна': 1, 'одно': 1, 'два': 2, 'две': 2, 'пару': 2, 'три': 3,
+    'четыре': 4, 'пять': 5, 'шесть': 6, 'семь': 7, 'восемь': 8, 'девять': 9, 'десять': 10,
+    'пятнадцать': 15, 'двадцать': 20, 'тридцать': 30, 'сорок': 40,
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'fifteen': 15, 'twenty': 20,
+    'thirty': 30, 'forty': 40,
+}
+
+# Интервалы одним словом
+_WHOLE_INTERVALS = {
+    'полчаса': (0, 1800),
+    'полминуты': (0, 30),
+    'полгода': (6, 0),
+    'полдня': (0, 43200),
+}
+
+_IN_WORDS = frozenset(('через', 'через-', 'in'))
+_AT_WORDS = frozenset(('в', 'во', 'at', 'on'))
+
+_RELATIVE_DAYS = {
+    'сегодня': 0, 'today': 0,
+    'завтра': 1, 'tomorrow': 1,
+    'послезавтра': 2,
+}
+
+WEEKDAYS = {
+    **dict.fromkeys(('понедельник', 'пн', 'monday', 'mon'), 0),
+    **dict.fromkeys(('вторник', 'вт', 'tuesday', 'tue', 'tues'), 1),
+    **dict.fromkeys(('среда', 'среду', 'ср', 'wednesday', 'wed'), 2),
+    **dict.fromkeys(('четверг', 'чт', 'thursday', 'thu', 'thur', 'thurs'), 3),
+    **dict.fromkeys(('пятница', 'пятницу', 'пт', 'friday', 'fri'), 4),
+    **dict.fromkeys(('суббота', 'субботу', 'сб', 'saturday', 'sat'), 5),
+    **dict.fromkeys(('воскресенье', 'вс', 'sunday', 'sun'), 6),
+}
+
+# Уточнение времени суток после часа: 'в 9 вечера', 'at 9 pm'
+_HALF_DAYS = {
+    'утра': 'am', 'am': 'am', 'a.m.': 'am',
+    'дня': 'pm', 'вечера': 'pm', 'pm': 'pm', 'p.m.': 'pm',
+    'ночи': 'night',
+}
+
+_ISO_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+_DOT_DATE_RE = re.compile(r'(\d{1,2})\.(\d{1,2})(?:\.(\d{4}|\d{2}))?')
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})(am|pm)?')
+_HOUR_RE = re.compile(r'(\d{1,2})(am|pm)?')
+_NUMBER_RE = re.compile(r'\d{1,6}')
+
+FORMAT_HELP = (
+    "Не удалось распознать срок. Примеры: 'завтра в 9', 'через 2 часа', "
+    "'в пятницу 18:00', '05.12 14:30', '2024-12-05 14:30'."
+)
+PAST_DUE = "Срок {:%d.%m.%Y %H:%M} уже прошёл. Укажите момент в будущем."
+
+
+def _apply_half_day(hour, half):
+    if half == 'am':
+        return 0 if hour == 12 else hour
+    if half == 'pm':
+        return hour if hour == 12 else hour + 12
+    # 'ночи': 12 ночи - полночь, остальные часы не меняются
+    return 0 if hour == 12 else hour
+
+
+def _parse_time(tokens, i):
+    """Время с позиции i: (часы, минуты, следующая позиция) или None."""
+    j = i
+    explicit = j < len(tokens) and tokens[j] in _AT_WORDS
+    if explicit:
+        j += 1
+    if j >= len(tokens):
+        return None
+    token = tokens[j]
+    match = _TIME_RE.fullmatch(token)
+    if match:
+        hour, minute, half = int(match.group(1)), int(match.group(2)), match.group(3)
+    else:
+        match = _HOUR_RE.fullmatch(token)
+        # Одно число считается часом только после 'в'/'at' или с am/pm: '/add 5 задач' - это текст
+        if match is None or not (explicit or match.group(2)):
+            return None
+        hour, minute, half = int(match.group(1)), 0, match.group(2)
+    j += 1
+    if half is None and j < len(tokens) and tokens[j] in _HALF_DAYS:
+        half = _HALF_DAYS[tokens[j]]
+        j += 1
+    if half is not None:
+        if not 1 <= hour <= 12:
+            raise ValueError(f"Неверный час: {token}.")
+        hour = _apply_half_day(hour, half)
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Неверное время: {token}. Используйте HH:MM.")
+    return hour, minute, j
+
+
+def _make_date(year, month, day):
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        raise ValueError(f"Несуществующая дата: {day:02d}.{month:02d}.{year}.")
+
+
+def _parse_day(tokens, now):
+    """День с начала tokens: (дата, следующая позиция, правило переноса) или None.
+
+    Правило переноса определяет, что делать, если момент уже прошёл:
+    'week' - на неделю вперёд, 'year' - на год вперёд, None - оставить как есть.
+    """
+    token = tokens[0]
+    if token in _RELATIVE_DAYS:
+        return now + timedelta(days=_RELATIVE_DAYS[token]), 1, None
+    i = 1 if token in _AT_WORDS and len(tokens) > 1 else 0
+    if tokens[i] in WEEKDAYS:
+        return now + timedelta(days=(WEEKDAYS[tokens[i]] - now.weekday()) % 7), i + 1, 'week'
+    match = _ISO_DATE_RE.fullmatch(token)
+    if match:
+        return _make_date(int(match.group(1)), int(match.group(2)), int(match.group(3))), 1, None
+    match = _DOT_DATE_RE.fullmatch(token)
+    if match:
+        day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        if year is None:
+            try:
+                return datetime(now.year, month, day), 1, 'year'
+            except ValueError:
+                # 29.02 в невисокосный год - ближайший такой день в следующем году
+                return _make_date(now.year + 1, month, day), 1, None
+        year = int(year)
+        return _make_date(year + 2000 if year < 100 else year, month, day), 1, None
+    return None
+
+
+def parse_interval(tokens):
+    """Разбор интервала вида '2 часа', 'час', '1 час 30 минут', 'полчаса'.
+
+    Возвращает (месяцев, секунд, количество разобранных слов); если интервал
+    не найден, выбрасывается ValueError.
+    """
+    months = seconds = 0
+    i = 0
+    found = False
+    while i < len(tokens):
+        token = tokens[i]
+        if token in _WHOLE_INTERVALS:
+            add_months, add_seconds = _WHOLE_INTERVALS[token]
+            months, seconds, i, found = months + add_months, seconds + add_seconds, i + 1, True
+            continue
+        j = i
+        value = None
+        if _NUMBER_RE.fullmatch(token):
+            value, j = int(token), j + 1
+        elif token in _NUMBERS:
+            value, j = _NUMBERS[token], j + 1
+        if j >= len(tokens) or tokens[j] not in UNITS:
+            break
+        if value is None:
+            if tokens[j] not in _SINGLE_UNITS:
+                break
+            value = 1
+        unit_months, unit_seconds = _UNIT_SIZES[UNITS[tokens[j]]]
+        months += value * unit_months
+        seconds += value * unit_seconds
+        i, found = j + 1, True
+    if not found:
+        raise ValueError(
+            "Неверный интервал. Пример: 'через 2 часа'.\n"
+            "Поддерживаемые единицы: секунды, минуты, часы, дни, недели, месяцы, годы."
+        )
+    return months, seconds, i
+
+
+def shift(moment, months=0, seconds=0):
+    """Сдвиг момента на интервал из parse_interval()."""
+    try:
+        return moment + relativedelta(months=months) + timedelta(seconds=seconds)
+    except (ValueError, OverflowError):
+        raise ValueError("Слишком большой интервал.")
+
+
+def parse_due(args, now):
+    """Разбор срока в начале списка слов args.
+
+    Возвращает (срок, количество разобранных слов); остальные слова - текст задачи.
+    При ошибке, в том числе для уже прошедшего срока, выбрасывается ValueError
+    с сообщением для пользователя.
+    """
+    tokens = [arg.lower() for arg in args]
+    if not tokens:
+        raise ValueError(FORMAT_HELP)
+
+    if tokens[0] in _IN_WORDS:
+        months, seconds, consumed = parse_interval(tokens[1:])
+        return shift(now, months, seconds), consumed + 1
+
+    day = _parse_day(tokens, now)
+    position = day[1] if day else 0
+    time = _parse_time(tokens, position)
+    if day is None and time is None:
+        raise ValueError(FORMAT_HELP)
+
+    if time is None:
+        hour, minute = DUE_DEFAULT_HOUR, 0
+    else:
+        hour, minute, position = time
+    if day is None:
+        # Только время: сегодня, а если оно уже прошло - завтра
+        due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if due <= now:
+            due += timedelta(days=1)
+        return due, position
+
+    date, _, roll = day
+    due = date.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if due <= now:
+        if roll == 'week':
+            due += timedelta(weeks=1)
+        elif roll == 'year':
+            due += relativedelta(years=1)
+        else:
+            # 'сегодня в 9' после 9:00 или явная дата в прошлом сработали бы сразу
+            raise ValueError(PAST_DUE.format(due))
+    return due, position
+
+
+def parse_due_text(text, now):
+    """Разбор строки, которая целиком состоит из срока (ответ в диалоге редактирования)."""
+    args = text.split()
+    due, consumed = parse_due(args, now)
+    if consumed != len(args):
+        raise ValueError(FORMAT_HELP)
+    return due
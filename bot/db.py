@@ -1,115 +1,1092 @@
 import asyncpg
 import logging
-from datetime import datetime
+import re
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 import os
-from dotenv import load_dotenv
+from dateutil.relativedelta import relativedelta
+from cache import TaskCache
+from metrics import DB_QUERY_LATENCY, timed
+from recurrence import next_occurrence
 
-# Загрузка переменных окружения
-load_dotenv()
-
-# Получаем строку подключения к базе данных из переменных окружения
+# Строка подключения к базе данных из переменных окружения (.env загружается в bot.py)
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if DATABASE_URL is None:
-    raise ValueError("Не указана DATABASE_URL в переменных окружения")
+# Настройки пула соединений
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Время простоя (в секундах), после которого соединение закрывается; 0 - не закрывать
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def get_db_connection():
-    """Функция для получения соединения с базой данных."""
-    try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        logger.info("Соединение с базой данных установлено.")
-        return conn
-    except Exception as e:
-        logger.error(f"Ошибка при подключении к базе данных: {e}")
-        return None
+# Общий пул соединений, создаётся в init_pool() при старте приложения
+_pool = None
+
+# Кэш чтения задач по пользователям; сбрасывается при каждом изменении их задач
+task_cache = TaskCache()
+
+# Статистика ожидания соединений из пула
+_acquire_stats = {
+    "acquired": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+}
+
+async def init_pool(database_url=None):
+    """Функция для создания общего пула соединений с базой данных."""
+    global _pool
+    if _pool is None:
+        database_url = database_url or DATABASE_URL
+        if database_url is None:
+            raise ValueError("Не указана DATABASE_URL в переменных окружения")
+        _pool = await asyncpg.create_pool(
+            database_url,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+        )
+        logger.info(
+            "Пул соединений создан (min=%s, max=%s, idle=%ss).", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_IDLE
+        )
+    return _pool
+
+async def close_pool():
+    """Функция для закрытия пула соединений."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        logger.info("Пул соединений закрыт.")
+
+@asynccontextmanager
+async def acquire():
+    """Получение соединения из пула с учётом времени ожидания."""
+    if _pool is None:
+        raise RuntimeError("Пул соединений не инициализирован, вызовите init_pool()")
+    started = time.monotonic()
+    async with _pool.acquire() as conn:
+        waited = time.monotonic() - started
+        _acquire_stats["acquired"] += 1
+        _acquire_stats["wait_total"] += waited
+        if waited > _acquire_stats["wait_max"]:
+            _acquire_stats["wait_max"] = waited
+        yield conn
+
+def timed_query(func):
+    """Декоратор для учёта длительности запроса в метриках."""
+    return timed(DB_QUERY_LATENCY, query=func.__name__)(func)
+
+def pool_stats():
+    """Функция для получения статистики пула соединений."""
+    acquired = _acquire_stats["acquired"]
+    stats = {
+        "size": 0,
+        "in_use": 0,
+        "idle": 0,
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "acquired": acquired,
+        "wait_total": _acquire_stats["wait_total"],
+        "wait_avg": _acquire_stats["wait_total"] / acquired if acquired else 0.0,
+        "wait_max": _acquire_stats["wait_max"],
+    }
+    if _pool is not None:
+        size = _pool.get_size()
+        idle = _pool.get_idle_size()
+        stats.update(size=size, idle=idle, in_use=size - idle)
+    return stats
+
+# Версионированные миграции схемы: (версия, описание, SQL).
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (1, "таблица задач", '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            due_date TIMESTAMP NOT NULL
+        )
+    '''),
+    (2, "отметка об отправленном напоминании", '''
+        ALTER TABLE tasks ADD COLUMN IF NOT EXISTS reminded_at TIMESTAMP;
+        CREATE INDEX IF NOT EXISTS tasks_pending_due_idx
+            ON tasks (due_date, id) WHERE reminded_at IS NULL
+    '''),
+    (3, "индекс задач пользователя по сроку", '''
+        CREATE INDEX IF NOT EXISTS tasks_user_due_idx ON tasks (user_id, due_date, id)
+    '''),
+    (4, "аренда напоминаний несколькими экземплярами", '''
+        ALTER TABLE tasks RENAME COLUMN reminded_at TO delivered_at;
+        ALTER TABLE tasks
+            ADD COLUMN lease_owner TEXT,
+            ADD COLUMN lease_expires_at TIMESTAMP;
+        DROP INDEX IF EXISTS tasks_pending_due_idx;
+        CREATE INDEX tasks_pending_due_idx ON tasks (due_date, id) WHERE delivered_at IS NULL
+    '''),
+    (5, "правило повторения задачи", '''
+        ALTER TABLE tasks ADD COLUMN recurrence TEXT
+    '''),
+    (6, "триграммный индекс для поиска по тексту задач", '''
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE EXTENSION IF NOT EXISTS btree_gin;
+        CREATE INDEX tasks_user_text_trgm_idx ON tasks USING gin (user_id, text gin_trgm_ops)
+    '''),
+    (7, "секционирование задач по сроку и архив выполненных задач", '''
+        ALTER TABLE tasks RENAME TO tasks_unpartitioned;
+        ALTER TABLE tasks_unpartitioned RENAME CONSTRAINT tasks_pkey TO tasks_unpartitioned_pkey;
+        DROP INDEX tasks_pending_due_idx, tasks_user_due_idx, tasks_user_text_trgm_idx;
+
+        CREATE TABLE tasks (
+            id INTEGER NOT NULL DEFAULT nextval('tasks_id_seq'),
+            user_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            due_date TIMESTAMP NOT NULL,
+            delivered_at TIMESTAMP,
+            lease_owner TEXT,
+            lease_expires_at TIMESTAMP,
+            recurrence TEXT,
+            PRIMARY KEY (id, due_date)
+        ) PARTITION BY RANGE (due_date);
+        ALTER SEQUENCE tasks_id_seq OWNED BY tasks.id;
+        CREATE TABLE tasks_default PARTITION OF tasks DEFAULT;
+        CREATE INDEX tasks_pending_due_idx ON tasks (due_date, id) WHERE delivered_at IS NULL;
+        CREATE INDEX tasks_user_due_idx ON tasks (user_id, due_date, id);
+        CREATE INDEX tasks_user_text_trgm_idx ON tasks USING gin (user_id, text gin_trgm_ops);
+
+        CREATE TABLE tasks_archive (
+            id INTEGER NOT NULL,
+            user_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            due_date TIMESTAMP NOT NULL,
+            recurrence TEXT,
+            status TEXT NOT NULL,
+            archived_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (id, due_date)
+        ) PARTITION BY RANGE (due_date);
+        CREATE TABLE tasks_archive_default PARTITION OF tasks_archive DEFAULT;
+        CREATE INDEX tasks_archive_user_due_idx ON tasks_archive (user_id, due_date, id);
+
+        INSERT INTO tasks (id, user_id, text, due_date, lease_owner, lease_expires_at, recurrence)
+        SELECT id, user_id, text, due_date, lease_owner, lease_expires_at, recurrence
+        FROM tasks_unpartitioned WHERE delivered_at IS NULL;
+        INSERT INTO tasks_archive (id, user_id, text, due_date, recurrence, status, archived_at)
+        SELECT id, user_id, text, due_date, recurrence, 'fired', delivered_at
+        FROM tasks_unpartitioned WHERE delivered_at IS NOT NULL;
+        DROP TABLE tasks_unpartitioned
+    '''),
+    (8, "состояние диалогов и user_data бота", '''
+        CREATE TABLE IF NOT EXISTS bot_user_data (
+            user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS bot_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (name, key)
+        )
+    '''),
+    (9, "счётчики задач пользователей для /stats", '''
+        CREATE TABLE user_task_stats (
+            user_id BIGINT PRIMARY KEY,
+            open_count INTEGER NOT NULL DEFAULT 0,
+            done_week DATE,
+            done_week_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE user_task_due_days (
+            user_id BIGINT NOT NULL,
+            due_day DATE NOT NULL,
+            task_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, due_day)
+        );
+        CREATE INDEX user_task_due_days_day_idx ON user_task_due_days (due_day);
+
+        INSERT INTO user_task_stats (user_id, open_count)
+        SELECT user_id, count(*) FROM tasks GROUP BY user_id;
+        INSERT INTO user_task_stats AS s (user_id, done_week, done_week_count)
+        SELECT user_id, date_trunc('week', localtimestamp)::date, count(*) FROM tasks_archive
+        WHERE status = 'done' AND archived_at >= date_trunc('week', localtimestamp)
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET done_week = EXCLUDED.done_week, done_week_count = EXCLUDED.done_week_count;
+        INSERT INTO user_task_due_days (user_id, due_day, task_count)
+        SELECT user_id, due_date::date, count(*) FROM tasks GROUP BY 1, 2
+    '''),
+]
+
+# Ключ advisory-блокировки, чтобы миграции не выполнялись одновременно несколькими экземплярами
+_MIGRATIONS_LOCK_ID = 7262001
 
-async def create_table():
-    """Функция для создания таблицы задач в базе данных."""
-    conn = await get_db_connection()
-    if conn:
-        try:
+@timed_query
+async def migrate():
+    """Функция для применения недостающих миграций схемы базы данных."""
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute('SELECT pg_advisory_xact_lock($1)', _MIGRATIONS_LOCK_ID)
             await conn.execute('''
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    text TEXT NOT NULL,
-                    due_date TIMESTAMP NOT NULL
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
                 )
             ''')
-            logger.info("Таблица 'tasks' успешно создана или уже существует.")
-        except Exception as e:
-            logger.error(f"Ошибка при создании таблицы: {e}")
-        finally:
-            await conn.close()
-            logger.info("Соединение с базой данных закрыто.")
-
-async def create_task(user_id, text, due_date):
-    """Функция для создания новой задачи в базе данных."""
-    conn = await get_db_connection()
-    if conn:
-        try:
-            result = await conn.fetch('''
-                INSERT INTO tasks (user_id, text, due_date) 
-                VALUES ($1, $2, $3) RETURNING id
-            ''', user_id, text, due_date)
-            task_id = result[0]['id']
-            logger.info(f"Задача создана с ID: {task_id}")
+            applied = {
+                row['version'] for row in await conn.fetch('SELECT version FROM schema_migrations')
+            }
+            for version, description, sql in MIGRATIONS:
+                if version in applied:
+                    continue
+                await conn.execute(sql)
+                await conn.execute('''
+                    INSERT INTO schema_migrations (version, description) VALUES ($1, $2)
+                ''', version, description)
+                logger.info("Применена миграция %s: %s", version, description)
+    logger.info("Схема базы данных актуальна (версия %s).", MIGRATIONS[-1][0])
+
+def week_start(moment):
+    """Понедельник недели, в которую попадает moment."""
+    day = moment.date()
+    return day - timedelta(days=day.weekday())
+
+async def _add_stats(conn, user_deltas, day_deltas, week):
+    """Прибавление приращений к счётчикам /stats.
+
+    user_deltas - {user_id: (открытых, выполнено за неделю week)},
+    day_deltas - {(user_id, день): задач со сроком в этот день}. Строки блокируются
+    в порядке ключей, чтобы параллельные транзакции не взаимоблокировались.
+    """
+    users = sorted(user for user, deltas in user_deltas.items() if any(deltas))
+    days = sorted(key for key, delta in day_deltas.items() if delta)
+    if not users and not days:
+        return
+    # Обе таблицы в одном запросе: табличные блокировки берутся в порядке упоминания
+    changed = await conn.fetch('''
+        WITH s AS (
+            INSERT INTO user_task_stats AS s (user_id, open_count, done_week, done_week_count)
+            SELECT u, o, $4, d FROM unnest($1::bigint[], $2::int[], $3::int[]) AS t(u, o, d)
+            ON CONFLICT (user_id) DO UPDATE
+            SET open_count = s.open_count + EXCLUDED.open_count,
+                done_week_count = CASE WHEN s.done_week = EXCLUDED.done_week THEN s.done_week_count ELSE 0 END
+                                  + EXCLUDED.done_week_count,
+                done_week = EXCLUDED.done_week
+        )
+        INSERT INTO user_task_due_days AS d (user_id, due_day, task_count)
+        SELECT * FROM unnest($5::bigint[], $6::date[], $7::int[])
+        ON CONFLICT (user_id, due_day) DO UPDATE SET task_count = d.task_count + EXCLUDED.task_count
+        RETURNING user_id, due_day, task_count
+    ''', users, [user_deltas[user][0] for user in users], [user_deltas[user][1] for user in users], week,
+        [user for user, _ in days], [day for _, day in days], [day_deltas[key] for key in days])
+    emptied = [row for row in changed if row['task_count'] <= 0]
+    if emptied:
+        await conn.execute('''
+            DELETE FROM user_task_due_days d
+            USING unnest($1::bigint[], $2::date[]) AS t(user_id, due_day)
+            WHERE d.user_id = t.user_id AND d.due_day = t.due_day AND d.task_count <= 0
+        ''', [row['user_id'] for row in emptied], [row['due_day'] for row in emptied])
+
+async def _apply_stats(conn, changes, now=None):
+    """Изменение счётчиков /stats в текущей транзакции вместе с самими задачами.
+
+    changes - четвёрки (user_id, прежний срок, новый срок, выполнена): прежний срок None
+    у новой задачи, новый срок None у задачи, покинувшей список активных.
+    """
+    user_deltas = defaultdict(lambda: [0, 0])
+    day_deltas = defaultdict(int)
+    for user_id, old_due, new_due, done in changes:
+        deltas = user_deltas[user_id]
+        deltas[0] += (new_due is not None) - (old_due is not None)
+        deltas[1] += bool(done)
+        if old_due is not None:
+            day_deltas[user_id, old_due.date()] -= 1
+        if new_due is not None:
+            day_deltas[user_id, new_due.date()] += 1
+    await _add_stats(conn, user_deltas, day_deltas, week_start(now or datetime.now()))
+
+@timed_query
+async def create_task(user_id, text, due_date, recurrence=None):
+    """Функция для создания новой задачи в базе данных.
+
+    recurrence - правило повторения (см. recurrence.py), due_date - ближайшее срабатывание.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                task_id = await conn.fetchval('''
+                    INSERT INTO tasks (user_id, text, due_date, recurrence)
+                    VALUES ($1, $2, $3, $4) RETURNING id
+                ''', user_id, text, due_date, recurrence)
+                await _apply_stats(conn, [(user_id, None, due_date, False)])
+            task_cache.invalidate(user_id)
+            logger.debug("Задача создана с ID: %s", task_id)
             return task_id
-        except Exception as e:
-            logger.error(f"Ошибка при создании задачи: {e}")
-        finally:
-            await conn.close()
-            logger.info("Соединение с базой данных закрыто.")
-
-async def get_tasks(user_id):
-    """Функция для получения всех задач пользователя."""
-    conn = await get_db_connection()
-    if conn:
-        try:
-            rows = await conn.fetch('''
-                SELECT id, text, due_date FROM tasks WHERE user_id = $1
-            ''', user_id)
-            logger.info(f"Полученные задачи: {rows}")
+    except Exception as e:
+        logger.error("Ошибка при создании задачи: %s", e)
+
+@timed_query
+async def get_tasks_page(user_id, limit, after=None, before=None):
+    """Функция для получения страницы задач пользователя с пагинацией по ключу (due_date, id).
+
+    after - ключ последней задачи предыдущей страницы, before - ключ первой задачи следующей.
+    Задачи всегда возвращаются в порядке возрастания (due_date, id).
+    """
+    key = ('page', limit, after, before)
+    hit, rows = task_cache.get(user_id, key)
+    if hit:
+        return rows
+    version = task_cache.version(user_id)
+    try:
+        async with acquire() as conn:
+            if before is not None:
+                rows = await conn.fetch('''
+                    SELECT id, text, due_date, recurrence FROM tasks
+                    WHERE user_id = $1 AND (due_date, id) < ($2, $3)
+                    ORDER BY due_date DESC, id DESC
+                    LIMIT $4
+                ''', user_id, before[0], before[1], limit)
+                rows = list(reversed(rows))
+            elif after is not None:
+                rows = await conn.fetch('''
+                    SELECT id, text, due_date, recurrence FROM tasks
+                    WHERE user_id = $1 AND (due_date, id) > ($2, $3)
+                    ORDER BY due_date, id
+                    LIMIT $4
+                ''', user_id, after[0], after[1], limit)
+            else:
+                rows = await conn.fetch('''
+                    SELECT id, text, due_date, recurrence FROM tasks
+                    WHERE user_id = $1
+                    ORDER BY due_date, id
+                    LIMIT $2
+                ''', user_id, limit)
+            task_cache.put(user_id, key, rows, version)
             return rows
-        except Exception as e:
-            logger.error(f"Ошибка при получении задач: {e}")
-            return []
-        finally:
-            await conn.close()
-            logger.info("Соединение с базой данных закрыто.")
-
-async def delete_task(task_id):
-    """Функция для удаления задачи по ID."""
-    conn = await get_db_connection()
-    if conn:
-        try:
+    except Exception as e:
+        logger.error("Ошибка при получении страницы задач: %s", e)
+        return []
+
+@timed_query
+async def get_task(user_id, task_id):
+    """Функция для получения задачи пользователя по ID.
+
+    Задача, только что показанная в списке, берётся из кэша страницы.
+    """
+    hit, row = task_cache.find_task(user_id, task_id)
+    if hit:
+        return row
+    version = task_cache.version(user_id)
+    try:
+        async with acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT id, text, due_date, recurrence FROM tasks WHERE id = $1 AND user_id = $2
+            ''', task_id, user_id)
+            task_cache.put(user_id, ('task', task_id), row, version)
+            return row
+    except Exception as e:
+        logger.error("Ошибка при получении задачи: %s", e)
+
+@timed_query
+async def delete_task(user_id, task_id):
+    """Функция для удаления задачи пользователя по ID.
+
+    Возвращает True, если задача принадлежала пользователю и была удалена.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                deleted = await conn.fetchval('''
+                    DELETE FROM tasks WHERE id = $1 AND user_id = $2 RETURNING due_date
+                ''', task_id, user_id)
+                if deleted is not None:
+                    await _apply_stats(conn, [(user_id, deleted, None, False)])
+            if deleted is not None:
+                task_cache.invalidate(user_id)
+                logger.debug("Задача с ID %s удалена.", task_id)
+            return deleted is not None
+    except Exception as e:
+        logger.error("Ошибка при удалении задачи: %s", e)
+        return False
+
+@timed_query
+async def update_task(user_id, task_id, new_text, new_due_date):
+    """Функция для обновления существующей задачи пользователя.
+
+    Возвращает обновлённую задачу или None, если задача не найдена у пользователя.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow('''
+                    WITH old AS (
+                        SELECT id, due_date FROM tasks WHERE id = $1 AND user_id = $2 FOR UPDATE
+                    )
+                    UPDATE tasks t
+                    SET text = $3, due_date = $4,
+                        delivered_at = NULL, lease_owner = NULL, lease_expires_at = NULL
+                    FROM old
+                    WHERE t.id = old.id AND t.user_id = $2
+                    RETURNING t.id, t.text, t.due_date, t.recurrence, old.due_date AS old_due_date
+                ''', task_id, user_id, new_text, new_due_date)
+                if row is not None:
+                    await _apply_stats(conn, [(user_id, row['old_due_date'], row['due_date'], False)])
+            if row is not None:
+                task_cache.invalidate(user_id)
+                logger.debug("Задача с ID %s обновлена.", task_id)
+            return row
+    except Exception as e:
+        logger.error("Ошибка при обновлении задачи: %s", e)
+
+@timed_query
+async def get_pending_reminders(until, limit, after=None):
+    """Функция для получения очередной порции неотправленных напоминаний до момента until.
+
+    Порции выбираются по ключу (due_date, id): after - последняя пара из предыдущей порции.
+    """
+    try:
+        async with acquire() as conn:
+            if after is None:
+                return await conn.fetch('''
+                    SELECT id, due_date FROM tasks
+                    WHERE delivered_at IS NULL AND due_date <= $1
+                    ORDER BY due_date, id
+                    LIMIT $2
+                ''', until, limit)
+            return await conn.fetch('''
+                SELECT id, due_date FROM tasks
+                WHERE delivered_at IS NULL AND due_date <= $1
+                  AND (due_date, id) > ($3, $4)
+                ORDER BY due_date, id
+                LIMIT $2
+            ''', until, limit, after[0], after[1])
+    except Exception as e:
+        logger.error("Ошибка при получении напоминаний: %s", e)
+        return []
+
+@timed_query
+async def claim_reminders(now, limit, owner, lease_seconds):
+    """Функция для аренды наступивших напоминаний текущим экземпляром бота.
+
+    Строки блокируются через FOR UPDATE SKIP LOCKED, поэтому несколько экземпляров
+    получают непересекающиеся порции. Аренда истекает через lease_seconds, после чего
+    недоставленное напоминание может забрать другой экземпляр.
+    """
+    try:
+        async with acquire() as conn:
+            return await conn.fetch('''
+                WITH due AS (
+                    SELECT id FROM tasks
+                    WHERE delivered_at IS NULL AND due_date <= $1
+                      AND (lease_expires_at IS NULL OR lease_expires_at < $1)
+                    ORDER BY due_date, id
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE tasks t
+                SET lease_owner = $3, lease_expires_at = $1 + make_interval(secs => $4)
+                FROM due
+                WHERE t.id = due.id
+                RETURNING t.id, t.user_id, t.text, t.due_date, t.recurrence
+            ''', now, limit, owner, float(lease_seconds))
+    except Exception as e:
+        logger.error("Ошибка при аренде напоминаний: %s", e)
+        return []
+
+@timed_query
+async def mark_delivered(task_ids, owner, now):
+    """Функция для переноса доставленных разовых напоминаний в архив.
+
+    Переносятся только задачи, аренда которых принадлежит owner: если задачу изменили
+    во время отправки, аренда снята и напоминание сработает заново в новый срок.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    WITH delivered AS (
+                        DELETE FROM tasks
+                        WHERE id = ANY($1::int[]) AND lease_owner = $2 AND delivered_at IS NULL
+                        RETURNING id, user_id, text, due_date, recurrence
+                    ),
+                    archived AS (
+                        INSERT INTO tasks_archive (id, user_id, text, due_date, recurrence, status, archived_at)
+                        SELECT id, user_id, text, due_date, recurrence, 'fired', $3 FROM delivered
+                        ON CONFLICT DO NOTHING
+                    )
+                    SELECT user_id, due_date FROM delivered
+                ''', task_ids, owner, now)
+                await _apply_stats(conn, [(row['user_id'], row['due_date'], None, False) for row in rows], now)
+            task_cache.invalidate(*{row['user_id'] for row in rows})
+            return True
+    except Exception as e:
+        logger.error("Ошибка при отметке доставленных напоминаний: %s", e)
+        return False
+
+@timed_query
+async def advance_recurring(items, owner, now):
+    """Функция для переноса повторяющихся задач на следующее срабатывание.
+
+    items - тройки (ID задачи, сработавший срок, новый срок). Сработавшее повторение
+    записывается в архив. Как и в mark_delivered, переносятся только задачи, аренда
+    которых принадлежит owner.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    WITH v AS (
+                        SELECT * FROM unnest($1::int[], $2::timestamp[], $3::timestamp[]) AS v(id, fired, due)
+                    ),
+                    advanced AS (
+                        UPDATE tasks t
+                        SET due_date = v.due, lease_owner = NULL, lease_expires_at = NULL
+                        FROM v
+                        WHERE t.id = v.id AND t.lease_owner = $4 AND t.delivered_at IS NULL
+                        RETURNING t.id, t.user_id, t.text, t.recurrence
+                    ),
+                    archived AS (
+                        INSERT INTO tasks_archive (id, user_id, text, due_date, recurrence, status, archived_at)
+                        SELECT a.id, a.user_id, a.text, v.fired, a.recurrence, 'fired', $5
+                        FROM advanced a JOIN v ON v.id = a.id
+                        ON CONFLICT DO NOTHING
+                    )
+                    SELECT a.user_id, v.fired, v.due FROM advanced a JOIN v ON v.id = a.id
+                ''', [item[0] for item in items], [item[1] for item in items], [item[2] for item in items], owner, now)
+                await _apply_stats(conn, [(row['user_id'], row['fired'], row['due'], False) for row in rows], now)
+            # Срок повторяющейся задачи изменился - списки пользователей устарели
+            task_cache.invalidate(*{row['user_id'] for row in rows})
+            return True
+    except Exception as e:
+        logger.error("Ошибка при переносе повторяющихся задач: %s", e)
+        return False
+
+async def iter_tasks(user_id, batch_size=500):
+    """Асинхронный генератор всех задач пользователя через курсор на стороне сервера.
+
+    Строки читаются порциями по batch_size, поэтому память не зависит от количества задач.
+    """
+    async with acquire() as conn:
+        async with conn.transaction():
+            async for row in conn.cursor('''
+                SELECT text, due_date, recurrence, delivered_at FROM tasks
+                WHERE user_id = $1
+                ORDER BY due_date, id
+            ''', user_id, prefetch=batch_size):
+                yield row
+
+@timed_query
+async def import_tasks(user_id, chunks):
+    """Функция для загрузки задач пользователя через COPY в одной транзакции.
+
+    chunks - итератор порций кортежей (text, due_date, recurrence, delivered_at).
+    Ошибка в любой порции откатывает весь импорт. Возвращает количество загруженных задач.
+    """
+    count = 0
+    changes = []
+    async with acquire() as conn:
+        async with conn.transaction():
+            for chunk in chunks:
+                await conn.copy_records_to_table(
+                    'tasks',
+                    records=[(user_id, *record) for record in chunk],
+                    columns=['user_id', 'text', 'due_date', 'recurrence', 'delivered_at'],
+                )
+                count += len(chunk)
+                changes.extend((user_id, None, due_date, False) for _, due_date, _, delivered_at in chunk
+                               if delivered_at is None)
+            # Уже сработавшие задачи из файла сразу попадают в архив
             await conn.execute('''
-                DELETE FROM tasks WHERE id = $1
-            ''', task_id)
-            logger.info(f"Задача с ID {task_id} удалена.")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении задачи: {e}")
-        finally:
-            await conn.close()
-            logger.info("Соединение с базой данных закрыто.")
-
-async def update_task(task_id, new_text, new_due_date):
-    """Функция для обновления существующей задачи."""
-    conn = await get_db_connection()
-    if conn:
-        try:
+                WITH delivered AS (
+                    DELETE FROM tasks WHERE user_id = $1 AND delivered_at IS NOT NULL
+                    RETURNING id, user_id, text, due_date, recurrence, delivered_at
+                )
+                INSERT INTO tasks_archive (id, user_id, text, due_date, recurrence, status, archived_at)
+                SELECT id, user_id, text, due_date, recurrence, 'fired', delivered_at FROM delivered
+            ''', user_id)
+            await _apply_stats(conn, changes)
+    task_cache.invalidate(user_id)
+    logger.info("Импортировано задач пользователя %s: %s", user_id, count)
+    return count
+
+@timed_query
+async def delete_tasks(user_id, task_ids):
+    """Функция для удаления нескольких задач пользователя одним запросом.
+
+    Возвращает список ID удалённых задач; чужие и несуществующие ID пропускаются.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    DELETE FROM tasks WHERE id = ANY($1::int[]) AND user_id = $2 RETURNING id, due_date
+                ''', task_ids, user_id)
+                await _apply_stats(conn, [(user_id, row['due_date'], None, False) for row in rows])
+            deleted = [row['id'] for row in rows]
+            if deleted:
+                task_cache.invalidate(user_id)
+                logger.debug("Удалены задачи пользователя %s: %s", user_id, deleted)
+            return deleted
+    except Exception as e:
+        logger.error("Ошибка при удалении задач: %s", e)
+        return []
+
+@timed_query
+async def postpone_tasks(user_id, now, months=0, seconds=0, task_ids=None):
+    """Функция для переноса задач пользователя на заданный интервал одним запросом.
+
+    Если task_ids не указан, переносятся все просроченные задачи пользователя.
+    Просроченная задача переносится от текущего момента, будущая - от своего срока.
+    Возвращает список пар (ID задачи, новый срок) или None при ошибке.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    WITH old AS (
+                        SELECT id, due_date FROM tasks
+                        WHERE user_id = $1
+                          AND (id = ANY($5::int[]) OR ($5::int[] IS NULL AND due_date <= $2))
+                        FOR UPDATE
+                    )
+                    UPDATE tasks t
+                    SET due_date = GREATEST(t.due_date, $2) + make_interval(months => $3, secs => $4),
+                        delivered_at = NULL, lease_owner = NULL, lease_expires_at = NULL
+                    FROM old
+                    WHERE t.id = old.id AND t.user_id = $1
+                    RETURNING t.id, t.due_date, old.due_date AS old_due_date
+                ''', user_id, now, months, float(seconds), task_ids)
+                await _apply_stats(conn, [(user_id, row['old_due_date'], row['due_date'], False) for row in rows], now)
+            if rows:
+                task_cache.invalidate(user_id)
+                logger.debug("Перенесены задачи пользователя %s: %s", user_id, [row['id'] for row in rows])
+            return [(row['id'], row['due_date']) for row in rows]
+    except Exception as e:
+        logger.error("Ошибка при переносе задач: %s", e)
+
+def _like_pattern(query):
+    """Шаблон ILIKE для подстроки query с экранированием спецсимволов."""
+    return '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+@timed_query
+async def search_tasks(user_id, query, limit, offset=0, due_from=None, due_to=None):
+    """Функция для поиска задач пользователя по тексту и диапазону сроков.
+
+    Совпадением считается подстрока (ILIKE) или похожее слово (оператор <% из pg_trgm);
+    оба условия используют индекс GIN (user_id, text gin_trgm_ops). Результаты
+    упорядочены по убыванию word_similarity, затем по сроку. Без query выполняется
+    только фильтр по сроку через индекс (user_id, due_date, id).
+    """
+    conditions = ['user_id = $1']
+    params = [user_id]
+    if due_from is not None:
+        params.append(due_from)
+        conditions.append(f'due_date >= ${len(params)}')
+    if due_to is not None:
+        params.append(due_to)
+        conditions.append(f'due_date < ${len(params)}')
+    order = 'due_date, id'
+    if query:
+        params.append(query)
+        query_param = f'${len(params)}'
+        params.append(_like_pattern(query))
+        conditions.append(f'(text ILIKE ${len(params)} OR {query_param} <% text)')
+        order = f'word_similarity({query_param}, text) DESC, due_date, id'
+    params.extend([limit, offset])
+    sql = f'''
+        SELECT id, text, due_date, recurrence FROM tasks
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {order}
+        LIMIT ${len(params) - 1} OFFSET ${len(params)}
+    '''
+    try:
+        async with acquire() as conn:
+            return await conn.fetch(sql, *params)
+    except Exception as e:
+        logger.error("Ошибка при поиске задач: %s", e)
+        return []
+
+@timed_query
+async def complete_tasks(user_id, task_ids, now):
+    """Функция для отметки задач пользователя выполненными.
+
+    Разовые задачи переносятся в архив. У повторяющейся задачи в архив записывается
+    текущее повторение, а сама задача переносится на следующее срабатывание.
+    Возвращает (ID перенесённых в архив задач, пары (ID, новый срок)) или None при ошибке.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    SELECT id, due_date, recurrence FROM tasks
+                    WHERE id = ANY($1::int[]) AND user_id = $2
+                    FOR UPDATE
+                ''', task_ids, user_id)
+                if not rows:
+                    return [], []
+                await conn.execute('''
+                    INSERT INTO tasks_archive (id, user_id, text, due_date, recurrence, status, archived_at)
+                    SELECT id, user_id, text, due_date, recurrence, 'done', $3 FROM tasks
+                    WHERE id = ANY($1::int[]) AND user_id = $2
+                    ON CONFLICT DO NOTHING
+                ''', [row['id'] for row in rows], user_id, now)
+                done = [row['id'] for row in rows if row['recurrence'] is None]
+                advanced = [
+                    (row['id'], next_occurrence(row['recurrence'], row['due_date'], now))
+                    for row in rows if row['recurrence'] is not None
+                ]
+                if done:
+                    await conn.execute('''
+                        DELETE FROM tasks WHERE id = ANY($1::int[]) AND user_id = $2
+                    ''', done, user_id)
+                if advanced:
+                    await conn.execute('''
+                        UPDATE tasks t
+                        SET due_date = v.due, delivered_at = NULL, lease_owner = NULL, lease_expires_at = NULL
+                        FROM unnest($1::int[], $2::timestamp[]) AS v(id, due)
+                        WHERE t.id = v.id AND t.user_id = $3
+                    ''', [task_id for task_id, _ in advanced], [due for _, due in advanced], user_id)
+                next_due = dict(advanced)
+                await _apply_stats(
+                    conn, [(user_id, row['due_date'], next_due.get(row['id']), True) for row in rows], now
+                )
+        task_cache.invalidate(user_id)
+        logger.debug("Выполнены задачи пользователя %s: %s", user_id, [row['id'] for row in rows])
+        return done, advanced
+    except Exception as e:
+        logger.error("Ошибка при отметке выполненных задач: %s", e)
+
+@timed_query
+async def get_history_page(user_id, limit, before=None):
+    """Функция для получения страницы архива задач пользователя, от новых к старым.
+
+    before - ключ (due_date, id) последней задачи предыдущей страницы.
+    """
+    try:
+        async with acquire() as conn:
+            if before is None:
+                return await conn.fetch('''
+                    SELECT id, text, due_date, recurrence, status, archived_at FROM tasks_archive
+                    WHERE user_id = $1
+                    ORDER BY due_date DESC, id DESC
+                    LIMIT $2
+                ''', user_id, limit)
+            return await conn.fetch('''
+                SELECT id, text, due_date, recurrence, status, archived_at FROM tasks_archive
+                WHERE user_id = $1 AND (due_date, id) < ($2, $3)
+                ORDER BY due_date DESC, id DESC
+                LIMIT $4
+            ''', user_id, before[0], before[1], limit)
+    except Exception as e:
+        logger.error("Ошибка при получении архива задач: %s", e)
+        return []
+
+@timed_query
+async def get_user_stats(user_id, now):
+    """Функция для получения статистики пользователя для /stats.
+
+    Открытые, на сегодня и выполненные за неделю берутся из счётчиков по первичному ключу.
+    Просроченные считаются по индексу (user_id, due_date, id): сработавшие напоминания
+    сразу уходят в архив, поэтому диапазон содержит только ещё не доставленные задачи
+    и почти всегда пуст, а время запроса не зависит от количества задач.
+    """
+    try:
+        async with acquire() as conn:
+            return await conn.fetchrow('''
+                SELECT COALESCE(s.open_count, 0) AS open_count,
+                       CASE WHEN s.done_week = $3 THEN s.done_week_count ELSE 0 END AS done_week,
+                       COALESCE((
+                           SELECT task_count FROM user_task_due_days WHERE user_id = $1 AND due_day = $2
+                       ), 0) AS due_today,
+                       (SELECT count(*) FROM tasks WHERE user_id = $1 AND due_date < $4) AS overdue
+                FROM (SELECT $1::bigint AS user_id) u
+                LEFT JOIN user_task_stats s ON s.user_id = u.user_id
+            ''', user_id, now.date(), week_start(now), now)
+    except Exception as e:
+        logger.error("Ошибка при получении статистики: %s", e)
+
+@timed_query
+async def get_global_stats(now):
+    """Функция для получения общей статистики по всем пользователям (для администраторов).
+
+    Суммы считаются по счётчикам, то есть по одной строке на пользователя, а не на задачу.
+    Просроченные считаются по частичному индексу недоставленных напоминаний.
+    """
+    try:
+        async with acquire() as conn:
+            return await conn.fetchrow('''
+                SELECT (SELECT count(*) FROM user_task_stats WHERE open_count > 0) AS users,
+                       (SELECT COALESCE(sum(open_count), 0) FROM user_task_stats) AS open_count,
+                       (SELECT COALESCE(sum(done_week_count), 0) FROM user_task_stats
+                        WHERE done_week = $2) AS done_week,
+                       (SELECT COALESCE(sum(task_count), 0) FROM user_task_due_days
+                        WHERE due_day = $1) AS due_today,
+                       (SELECT count(*) FROM tasks WHERE delivered_at IS NULL AND due_date < $3) AS overdue
+            ''', now.date(), week_start(now), now)
+    except Exception as e:
+        logger.error("Ошибка при получении общей статистики: %s", e)
+
+# Ключ advisory-блокировки, чтобы сверка счётчиков шла только на одном экземпляре
+_STATS_LOCK_ID = 7262003
+
+async def _stats_users(conn, after, limit):
+    """Очередная порция пользователей с задачами или счётчиками, по возрастанию user_id.
+
+    Пользователи задач перебираются рекурсивным запросом по индексу (user_id, due_date, id),
+    по одному шагу индекса на пользователя, а не на задачу.
+    """
+    rows = await conn.fetch('''
+        WITH RECURSIVE task_users AS (
+            (SELECT user_id FROM tasks WHERE user_id > $1 ORDER BY user_id LIMIT 1)
+            UNION ALL
+            SELECT (SELECT user_id FROM tasks WHERE user_id > t.user_id ORDER BY user_id LIMIT 1)
+            FROM task_users t WHERE t.user_id IS NOT NULL
+        )
+        SELECT user_id FROM (
+            (SELECT user_id FROM task_users WHERE user_id IS NOT NULL LIMIT $2)
+            UNION
+            (SELECT user_id FROM user_task_stats WHERE user_id > $1 ORDER BY user_id LIMIT $2)
+        ) u
+        ORDER BY user_id
+        LIMIT $2
+    ''', after, limit)
+    return [row['user_id'] for row in rows]
+
+@timed_query
+async def reconcile_stats(now, batch_size=500):
+    """Функция для сверки счётчиков /stats с задачами и исправления расхождений.
+
+    Пользователи обрабатываются порциями по batch_size. Задачи и счётчики порции читаются
+    в одном снимке (REPEATABLE READ), и расхождение прибавляется к счётчикам так же, как
+    обычные изменения, поэтому сверка не блокирует запись задач и не теряет изменения,
+    сделанные после снимка. Возвращает количество пользователей с расхождениями или None,
+    если сверка уже идёт на другом экземпляре или произошла ошибка.
+    """
+    week = week_start(now)
+    week_began = datetime.combine(week, datetime.min.time())
+    drifted = 0
+    try:
+        async with acquire() as conn:
+            if not await conn.fetchval('SELECT pg_try_advisory_lock($1)', _STATS_LOCK_ID):
+                return None
+            try:
+                after = -(2 ** 63)
+                while True:
+                    async with conn.transaction(isolation='repeatable_read', readonly=True):
+                        users = await _stats_users(conn, after, batch_size)
+                        if not users:
+                            break
+                        day_rows = await conn.fetch('''
+                            SELECT user_id, due_date::date AS due_day, count(*) AS task_count FROM tasks
+                            WHERE user_id = ANY($1::bigint[])
+                            GROUP BY 1, 2
+                        ''', users)
+                        done_rows = await conn.fetch('''
+                            SELECT user_id, count(*) AS done_count FROM tasks_archive
+                            WHERE user_id = ANY($1::bigint[]) AND status = 'done' AND archived_at >= $2
+                            GROUP BY user_id
+                        ''', users, week_began)
+                        stored_stats = await conn.fetch('''
+                            SELECT user_id, open_count,
+                                   CASE WHEN done_week = $2 THEN done_week_count ELSE 0 END AS done_count
+                            FROM user_task_stats WHERE user_id = ANY($1::bigint[])
+                        ''', users, week)
+                        stored_days = await conn.fetch('''
+                            SELECT user_id, due_day, task_count FROM user_task_due_days
+                            WHERE user_id = ANY($1::bigint[])
+                        ''', users)
+
+                    user_deltas = defaultdict(lambda: [0, 0])
+                    day_deltas = defaultdict(int)
+                    for row in day_rows:
+                        user_deltas[row['user_id']][0] += row['task_count']
+                        day_deltas[row['user_id'], row['due_day']] += row['task_count']
+                    for row in done_rows:
+                        user_deltas[row['user_id']][1] += row['done_count']
+                    for row in stored_stats:
+                        user_deltas[row['user_id']][0] -= row['open_count']
+                        user_deltas[row['user_id']][1] -= row['done_count']
+                    for row in stored_days:
+                        day_deltas[row['user_id'], row['due_day']] -= row['task_count']
+
+                    changed = {user for user, deltas in user_deltas.items() if any(deltas)}
+                    changed.update(user for (user, _), delta in day_deltas.items() if delta)
+                    if changed:
+                        drifted += len(changed)
+                        logger.debug("Расхождения счётчиков у пользователей: %s", sorted(changed))
+                        async with conn.transaction():
+                            await _add_stats(conn, user_deltas, day_deltas, week)
+                    after = users[-1]
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock($1)', _STATS_LOCK_ID)
+        return drifted
+    except Exception as e:
+        logger.error("Ошибка при сверке счётчиков статистики: %s", e)
+
+@timed_query
+async def load_user_data(user_id):
+    """Функция для загрузки сохранённых user_data пользователя (JSON-строка).
+
+    Возвращает None, если данных нет, и выбрасывает исключение при ошибке базы данных,
+    чтобы загрузка была повторена при следующем обновлении.
+    """
+    async with acquire() as conn:
+        return await conn.fetchval('SELECT data FROM bot_user_data WHERE user_id = $1', user_id)
+
+@timed_query
+async def load_conversations(name, max_age):
+    """Функция для загрузки состояний диалога name, изменённых не более max_age секунд назад.
+
+    Возвращает список (ключ, состояние) в виде JSON-строк; более старые состояния удаляются.
+    """
+    async with acquire() as conn:
+        async with conn.transaction():
             await conn.execute('''
-                UPDATE tasks 
-                SET text = $1, due_date = $2 
-                WHERE id = $3
-            ''', new_text, new_due_date, task_id)
-            logger.info(f"Задача с ID {task_id} обновлена.")
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении задачи: {e}")
-        finally:
-            await conn.close()
-            logger.info("Соединение с базой данных закрыто.")
+                DELETE FROM bot_conversations
+                WHERE name = $1 AND updated_at < now() - make_interval(secs => $2)
+            ''', name, float(max_age))
+            rows = await conn.fetch('SELECT key, state FROM bot_conversations WHERE name = $1', name)
+    return [(row['key'], row['state']) for row in rows]
+
+@timed_query
+async def save_bot_state(user_data, dropped_users, conversations, dropped_conversations):
+    """Функция для записи накопленных изменений состояния бота одной транзакцией.
+
+    user_data - список (user_id, JSON), conversations - список (имя, ключ, JSON);
+    dropped_* - удалённые записи. Каждая таблица обновляется одним многострочным
+    запросом. Возвращает True, если изменения записаны.
+    """
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                if user_data:
+                    await conn.execute('''
+                        INSERT INTO bot_user_data (user_id, data, updated_at)
+                        SELECT user_id, data, now() FROM unnest($1::bigint[], $2::jsonb[]) AS t(user_id, data)
+                        ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+                    ''', [row[0] for row in user_data], [row[1] for row in user_data])
+                if dropped_users:
+                    await conn.execute('DELETE FROM bot_user_data WHERE user_id = ANY($1::bigint[])', dropped_users)
+                if conversations:
+                    await conn.execute('''
+                        INSERT INTO bot_conversations (name, key, state, updated_at)
+                        SELECT name, key, state, now() FROM unnest($1::text[], $2::text[], $3::jsonb[]) AS t(name, key, state)
+                        ON CONFLICT (name, key) DO UPDATE SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at
+                    ''', *[[row[i] for row in conversations] for i in range(3)])
+                if dropped_conversations:
+                    await conn.execute('''
+                        DELETE FROM bot_conversations AS c
+                        USING unnest($1::text[], $2::text[]) AS t(name, key)
+                        WHERE c.name = t.name AND c.key = t.key
+                    ''', *[[row[i] for row in dropped_conversations] for i in range(2)])
+        return True
+    except Exception as e:
+        logger.error("Ошибка при сохранении состояния бота: %s", e)
+        return False
+
+# Таблицы, секционированные по месяцам срока задачи; у каждой есть секция <таблица>_default
+_PARTITIONED_TABLES = ('tasks', 'tasks_archive')
+_PARTITION_NAME_RE = re.compile(r'_p(\d{4})_(\d{2})$')
+# Ключ advisory-блокировки, чтобы обслуживание секций выполнял один экземпляр
+_MAINTENANCE_LOCK_ID = 7262002
+# Ожидание блокировок при изменении секций, чтобы не останавливать работу бота надолго
+_PARTITION_LOCK_TIMEOUT = '5s'
+
+async def _partitions(conn, table):
+    """Помесячные секции таблицы: {первое число месяца: имя секции}."""
+    rows = await conn.fetch('''
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass
+    ''', table)
+    partitions = {}
+    for row in rows:
+        match = _PARTITION_NAME_RE.search(row['relname'])
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1)] = row['relname']
+    return partitions
+
+async def _create_partition(conn, table, month):
+    """Создание секции за месяц с переносом её строк из секции по умолчанию."""
+    name = f"{table}_p{month:%Y_%m}"
+    end = month + relativedelta(months=1)
+    async with conn.transaction():
+        await conn.execute(f"SET LOCAL lock_timeout = '{_PARTITION_LOCK_TIMEOUT}'")
+        await conn.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)')
+        # Новые строки месяца не должны попасть в секцию по умолчанию между переносом
+        # и ATTACH PARTITION, иначе проверка секции по умолчанию не пройдёт
+        await conn.execute(f'LOCK TABLE {table}_default IN SHARE ROW EXCLUSIVE MODE')
+        await conn.execute(f'''
+            WITH moved AS (
+                DELETE FROM {table}_default WHERE due_date >= $1 AND due_date < $2 RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        ''', month, end)
+        await conn.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        )
+    return name
+
+async def _remove_partition(conn, table, name, detach, only_if_empty=False):
+    """Отсоединение (и удаление, если detach=False) секции; True, если секция убрана."""
+    async with conn.transaction():
+        await conn.execute(f"SET LOCAL lock_timeout = '{_PARTITION_LOCK_TIMEOUT}'")
+        if only_if_empty:
+            await conn.execute(f'LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE')
+            if await conn.fetchval(f'SELECT EXISTS (SELECT 1 FROM {name})'):
+                return False
+        await conn.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+        if not detach:
+            await conn.execute(f'DROP TABLE {name}')
+    return True
+
+@timed_query
+async def maintain_partitions(now, months_ahead, retention_months, detach=False):
+    """Функция для обслуживания помесячных секций задач и архива.
+
+    Создаёт секции с прошлого месяца на months_ahead месяцев вперёд, удаляет опустевшие
+    секции активных задач старше прошлого месяца и убирает секции архива старше
+    retention_months месяцев (0 - архив хранится бессрочно). При detach=True старые
+    секции архива только отсоединяются и остаются отдельными таблицами.
+    Возвращает список выполненных действий или None, если обслуживание уже идёт
+    на другом экземпляре или произошла ошибка.
+    """
+    month = datetime(now.year, now.month, 1)
+    actions = []
+    try:
+        async with acquire() as conn:
+            if not await conn.fetchval('SELECT pg_try_advisory_lock($1)', _MAINTENANCE_LOCK_ID):
+                return None
+            try:
+                for table in _PARTITIONED_TABLES:
+                    existing = await _partitions(conn, table)
+                    for offset in range(-1, months_ahead + 1):
+                        target = month + relativedelta(months=offset)
+                        if target not in existing:
+                            actions.append(f"создана секция {await _create_partition(conn, table, target)}")
+
+                # Секции активных задач пустеют по мере срабатывания напоминаний
+                previous = month - relativedelta(months=1)
+                for start, name in sorted((await _partitions(conn, 'tasks')).items()):
+                    if start < previous and await _remove_partition(conn, 'tasks', name, False, only_if_empty=True):
+                        actions.append(f"удалена пустая секция {name}")
+
+                if retention_months > 0:
+                    cutoff = month - relativedelta(months=retention_months)
+                    for start, name in sorted((await _partitions(conn, 'tasks_archive')).items()):
+                        if start + relativedelta(months=1) <= cutoff:
+                            await _remove_partition(conn, 'tasks_archive', name, detach)
+                            actions.append(f"{'отсоединена' if detach else 'удалена'} секция архива {name}")
+                    result = await conn.execute('''
+                        DELETE FROM tasks_archive_default WHERE due_date < $1
+                    ''', cutoff)
+                    if result != 'DELETE 0':
+                        actions.append(f"из архива по умолчанию удалено строк: {result.split()[-1]}")
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock($1)', _MAINTENANCE_LOCK_ID)
+        for action in actions:
+            logger.info("Обслуживание секций: %s", action)
+        return actions
+    except Exception as e:
+        logger.error("Ошибка при обслуживании секций: %s", e)
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+
+from metrics import REMINDER_SENDS_SAVED
+
+# Окно (в секундах), в течение которого напоминания одному пользователю собираются
+# в одно сообщение; 0 - каждое напоминание отправляется сразу отдельным сообщением
+REMINDER_COALESCE_SECONDS = float(os.getenv("REMINDER_COALESCE_SECONDS", "0"))
+# Максимальная длина одного сообщения-сводки (лимит Telegram - 4096 символов)
+REMINDER_DIGEST_MAX_LENGTH = int(os.getenv("REMINDER_DIGEST_MAX_LENGTH", "4000"))
+
+logger = logging.getLogger(__name__)
+
+
+def format_reminder(text):
+    return f"Напоминание: {text}"
+
+
+class ReminderCoalescer:
+    """Объединение напоминаний одному пользователю в сводку за окно window.
+
+    Первое напоминание пользователя открывает окно; все напоминания, пришедшие до
+    его закрытия, отправляются одним сообщением (или несколькими, если сводка не
+    помещается в лимит длины). Поэтому напоминание может прийти позже срока не
+    более чем на window секунд.
+
+    send(user_id, text, due_dates) отправляет одно сообщение и возвращает future
+    с признаком доставки; submit() имеет ту же сигнатуру, что ожидает
+    ReminderDispatcher, и возвращает future для каждого напоминания.
+    """
+
+    def __init__(self, send, window=REMINDER_COALESCE_SECONDS, max_length=REMINDER_DIGEST_MAX_LENGTH):
+        self._send = send
+        self.window = window
+        self.max_length = max_length
+        # user_id -> список (текст, срок, future)
+        self._buffers = {}
+        self._timers = {}
+        self._flushes = set()
+        self.saved = 0
+
+    @property
+    def pending(self):
+        """Количество напоминаний, ожидающих закрытия окна."""
+        return sum(len(items) for items in self._buffers.values())
+
+    async def submit(self, user_id, text, due_date):
+        if self.window <= 0:
+            return await self._send(user_id, format_reminder(text), [due_date])
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        items = self._buffers.get(user_id)
+        if items is None:
+            items = self._buffers[user_id] = []
+            self._timers[user_id] = loop.call_later(self.window, self._flush_later, user_id)
+        items.append((text, due_date, future))
+        return future
+
+    async def close(self):
+        """Немедленная отправка всех накопленных сводок (при остановке бота)."""
+        for timer in self._timers.values():
+            timer.cancel()
+        for user_id in list(self._buffers):
+            await self._flush(user_id)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush_later(self, user_id):
+        task = asyncio.get_running_loop().create_task(self._flush(user_id))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _compose(self, items):
+        """Разбиение напоминаний на сообщения не длиннее max_length."""
+        if len(items) == 1:
+            return [(format_reminder(items[0][0])[:self.max_length], items)]
+        header = "Напоминания:"
+        messages = []
+        lines, chunk, length = [header], [], len(header)
+        for item in sorted(items, key=lambda item: item[1]):
+            text, due_date, _ = item
+            line = f"• {due_date.strftime('%H:%M')} {text}"[:self.max_length - len(header) - 1]
+            if chunk and length + 1 + len(line) > self.max_length:
+                messages.append(("\n".join(lines), chunk))
+                lines, chunk, length = [header], [], len(header)
+            lines.append(line)
+            chunk.append(item)
+            length += 1 + len(line)
+        messages.append(("\n".join(lines), chunk))
+        return messages
+
+    async def _flush(self, user_id):
+        self._timers.pop(user_id, None)
+        items = self._buffers.pop(user_id, None)
+        if not items:
+            return
+        messages = self._compose(items)
+        for text, chunk in messages:
+            futures = [future for _, _, future in chunk]
+            try:
+                result = await self._send(user_id, text, [due_date for _, due_date, _ in chunk])
+            except Exception as e:
+                logger.error("Ошибка при отправке сводки напоминаний: %s", e)
+                for future in futures:
+                    if not future.done():
+                        future.set_result(False)
+                continue
+            result.add_done_callback(lambda done, futures=futures: self._resolve(done, futures))
+        saved = len(items) - len(messages)
+        if saved:
+            self.saved += saved
+            REMINDER_SENDS_SAVED.inc(saved)
+
+    @staticmethod
+    def _resolve(done, futures):
+        delivered = not done.cancelled() and done.exception() is None and bool(done.result())
+        for future in futures:
+            if not future.done():
+                future.set_result(delivered)
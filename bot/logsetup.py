@@ -0,0 +1,162 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Уровень логирования
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Формат записей: json (по строке JSON на запись) или text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Доля записей уровня DEBUG, которые попадают в лог
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+# Максимальное количество записей одного сообщения ниже WARNING в секунду; 0 - без ограничения
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "20"))
+# 1 - писать текст задач в лог (только для отладки)
+LOG_TASK_TEXT = os.getenv("LOG_TASK_TEXT", "0") == "1"
+
+# Идентификатор обрабатываемого обновления или напоминания для связи записей лога
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+# Стандартные атрибуты LogRecord, не попадающие в JSON как дополнительные поля
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "correlation_id"}
+
+_listener = None
+
+
+class Redacted:
+    """Значение, которое не выводится в лог целиком (например, текст задачи)."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        if LOG_TASK_TEXT:
+            return str(self.value)
+        return f"<скрыто, {len(str(self.value))} симв.>"
+
+    __repr__ = __str__
+
+
+def redact(value):
+    return Redacted(value)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи идентификатор корреляции из контекста обработки."""
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Выборка записей DEBUG и ограничение частоты одинаковых сообщений ниже WARNING."""
+
+    def __init__(self, debug_rate=LOG_DEBUG_SAMPLE_RATE, per_second=LOG_RATE_LIMIT):
+        super().__init__()
+        self.debug_rate = debug_rate
+        self.per_second = per_second
+        # шаблон сообщения -> [начало текущей секунды, количество записей]
+        self._windows = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if record.levelno <= logging.DEBUG and random.random() >= self.debug_rate:
+            self.dropped += 1
+            return False
+        if self.per_second <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= 1.0:
+            if len(self._windows) > 10000:
+                self._windows.clear()
+            self._windows[key] = [now, 1]
+            return True
+        window[1] += 1
+        if window[1] > self.per_second:
+            self.dropped += 1
+            return False
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Сообщение форматируется в потоке QueueListener, а не в цикле событий
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в виде одной строки JSON."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            entry["correlation_id"] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Настройка логирования приложения; повторные вызовы ничего не меняют.
+
+    Записи из всех потоков попадают в очередь через QueueHandler, а вывод в поток
+    выполняет QueueListener в отдельном потоке.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+        ))
+
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Библиотеки пишут запрос на каждый вызов API на уровне INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Вывод оставшихся в очереди записей и остановка потока логирования."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,45 @@
+import logging
+import os
+from datetime import datetime
+
+from db import maintain_partitions, reconcile_stats
+
+# Количество месяцев вперёд, для которых заранее создаются секции задач и архива
+TASK_PARTITIONS_AHEAD = int(os.getenv("TASK_PARTITIONS_AHEAD", "3"))
+# Срок хранения архива в месяцах; 0 - архив хранится бессрочно
+TASK_ARCHIVE_RETENTION_MONTHS = int(os.getenv("TASK_ARCHIVE_RETENTION_MONTHS", "12"))
+# 1 - старые секции архива только отсоединяются (например, для выгрузки), 0 - удаляются
+TASK_ARCHIVE_DETACH = os.getenv("TASK_ARCHIVE_DETACH", "0") == "1"
+# Интервал (в часах) между запусками обслуживания секций
+TASK_MAINTENANCE_INTERVAL_HOURS = float(os.getenv("TASK_MAINTENANCE_INTERVAL_HOURS", "6"))
+# Интервал (в часах) между сверками счётчиков /stats с задачами
+STATS_RECONCILE_INTERVAL_HOURS = float(os.getenv("STATS_RECONCILE_INTERVAL_HOURS", "24"))
+# Количество пользователей, сверяемых в одной транзакции
+STATS_RECONCILE_BATCH_SIZE = int(os.getenv("STATS_RECONCILE_BATCH_SIZE", "500"))
+
+logger = logging.getLogger(__name__)
+
+
+async def maintenance_job(context):
+    """Периодическая задача job_queue: создание новых и удаление старых секций."""
+    actions = await maintain_partitions(
+        datetime.now(),
+        TASK_PARTITIONS_AHEAD,
+        TASK_ARCHIVE_RETENTION_MONTHS,
+        detach=TASK_ARCHIVE_DETACH,
+    )
+    if actions is None:
+        logger.info("Обслуживание секций пропущено: выполняется другим экземпляром или завершилось ошибкой.")
+    elif not actions:
+        logger.info("Обслуживание секций: изменений не требуется.")
+
+
+async def stats_reconcile_job(context):
+    """Периодическая задача job_queue: исправление расхождений счётчиков /stats."""
+    drifted = await reconcile_stats(datetime.now(), STATS_RECONCILE_BATCH_SIZE)
+    if drifted is None:
+        logger.info("Сверка счётчиков пропущена: выполняется другим экземпляром или завершилась ошибкой.")
+    elif drifted:
+        logger.warning("Сверка счётчиков: исправлены расхождения у пользователей: %s", drifted)
+    else:
+        logger.info("Сверка счётчиков: расхождений нет.")
@@ -0,0 +1,244 @@
+import asyncio
+import functools
+import logging
+import math
+import os
+import time
+
+# Порт HTTP-сервера метрик; 0 - сервер не запускается
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+# Все зарегистрированные метрики в порядке создания
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метка метрики {self.name}: ожидаются {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно возрастающий счётчик."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться функцией callback при каждом чтении.
+
+    callback возвращает число (метрика без меток) или словарь
+    {кортеж значений меток: число}.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self):
+        values = self._values
+        if self._callback is not None:
+            try:
+                values = self._callback()
+            except Exception as e:
+                logger.error("Ошибка при вычислении метрики %s: %s", self.name, e)
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Гистограмма распределения значений (например, длительностей)."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # ключ меток -> [счётчики по корзинам, сумма, количество]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Метрики бота
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds", "Длительность обработчиков обновлений", ["handler"]
+)
+DB_QUERY_LATENCY = Histogram(
+    "bot_db_query_duration_seconds", "Длительность запросов к базе данных", ["query"]
+)
+REMINDER_LAG = Histogram(
+    "bot_reminder_lag_seconds",
+    "Задержка доставки напоминания: время отправки минус срок задачи",
+    buckets=(0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0),
+)
+TELEGRAM_ERRORS = Counter(
+    "bot_telegram_errors_total", "Ошибки Telegram Bot API по типу", ["type"]
+)
+REMINDER_SENDS_SAVED = Counter(
+    "bot_reminder_sends_saved_total", "Сообщения, сэкономленные объединением напоминаний в сводки"
+)
+TASK_CACHE_EVENTS = Counter(
+    "bot_task_cache_events_total", "События кэша задач: hit, miss, eviction", ["event"]
+)
+
+
+def timed(histogram, **labels):
+    """Декоратор для измерения длительности корутины в гистограмме."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.monotonic() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def timed_handler(func):
+    """Декоратор для измерения длительности обработчика обновлений."""
+    return timed(HANDLER_LATENCY, handler=func.__name__)(func)
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер для /metrics и других служебных эндпоинтов."""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        # путь -> функция, возвращающая (код ответа, тело)
+        self.routes = {"/metrics": lambda: (200, render())}
+        self._server = None
+
+    async def start(self):
+        if not self.port:
+            return
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("HTTP-сервер метрик запущен на %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Заголовки запроса не используются
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode(errors="replace").split()
+            path = parts[1].split("?", 1)[0] if len(parts) > 1 else "/"
+            route = self.routes.get(path)
+            if route is None:
+                status, body = 404, "not found\n"
+            else:
+                status, body = route()
+            payload = body.encode()
+            reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}.get(status, "OK")
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
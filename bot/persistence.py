@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import load_conversations, load_user_data, save_bot_state
+
+# Интервал (в секундах), с которым изменения user_data и состояний диалогов записываются в базу
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "10"))
+# Через сколько часов незавершённый диалог не восстанавливается после перезапуска
+PERSISTENCE_CONVERSATION_TTL_HOURS = float(os.getenv("PERSISTENCE_CONVERSATION_TTL_HOURS", "24"))
+# Количество пользователей, для которых запоминается, что их user_data уже загружены
+PERSISTENCE_LOADED_USERS = int(os.getenv("PERSISTENCE_LOADED_USERS", "10000"))
+
+logger = logging.getLogger(__name__)
+
+
+def _conversation_key(key):
+    return json.dumps(list(key))
+
+
+class DatabasePersistence(BasePersistence):
+    """Хранение user_data и состояний ConversationHandler в PostgreSQL.
+
+    Изменения не записываются на каждое сообщение: Application передаёт их раз в
+    update_interval секунд, они накапливаются в буфере и записываются одной
+    транзакцией с многострочными upsert (save_bot_state), а при остановке бота -
+    в flush(). user_data загружается не при старте, а при первом обновлении от
+    пользователя (refresh_user_data). Состояния диалогов загружаются при старте:
+    в базе хранятся только незавершённые диалоги не старше conversation_ttl.
+
+    prepare - корутина, которая выполняется перед первым обращением к базе данных
+    (создание пула и применение миграций): Application загружает состояния
+    диалогов в initialize(), ещё до post_init.
+    """
+
+    def __init__(self, prepare=None, update_interval=PERSISTENCE_UPDATE_INTERVAL,
+                 conversation_ttl=PERSISTENCE_CONVERSATION_TTL_HOURS * 3600,
+                 max_loaded=PERSISTENCE_LOADED_USERS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._prepare = prepare
+        self.conversation_ttl = conversation_ttl
+        # Пользователи, чьи user_data уже загружены или изменены после старта (LRU).
+        # Вытесненный пользователь загружается повторно: его изменения уже записаны,
+        # поэтому загрузка ничего не меняет
+        self._loaded = OrderedDict()
+        self.max_loaded = max_loaded
+        # Изменения, ещё не записанные в базу: значение None означает удаление
+        self._user_data = {}
+        # Изменения, которые записываются в базу прямо сейчас
+        self._writing = {}
+        self._conversations = {}
+        self._flush_task = None
+        # Создаётся в цикле событий приложения при первой записи
+        self._lock = None
+
+    async def _ready(self):
+        if self._prepare is not None:
+            prepare, self._prepare = self._prepare, None
+            await prepare()
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        await self._ready()
+        rows = await load_conversations(name, self.conversation_ttl)
+        logger.info("Восстановлено незавершённых диалогов %s: %s", name, len(rows))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversations[(name, _conversation_key(key))] = (
+            None if new_state is None else json.dumps(new_state)
+        )
+        self._schedule_flush()
+
+    def _mark_loaded(self, user_id):
+        self._loaded[user_id] = None
+        self._loaded.move_to_end(user_id)
+        for _ in range(len(self._loaded) - self.max_loaded):
+            oldest, _ = self._loaded.popitem(last=False)
+            if oldest in self._user_data or oldest in self._writing:
+                # Незаписанные изменения: повторная загрузка вернула бы устаревшие данные
+                self._loaded[oldest] = None
+
+    async def update_user_data(self, user_id, data):
+        self._mark_loaded(user_id)
+        try:
+            # Пустые user_data не хранятся
+            self._user_data[user_id] = json.dumps(data, ensure_ascii=False) if data else None
+        except (TypeError, ValueError) as e:
+            logger.error("user_data пользователя %s не сохранены: %s", user_id, e)
+            return
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._mark_loaded(user_id)
+        self._user_data[user_id] = None
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            self._loaded.move_to_end(user_id)
+            return
+        try:
+            data = await load_user_data(user_id)
+        except Exception as e:
+            # Загрузка будет повторена при следующем обновлении пользователя
+            logger.error("Ошибка при загрузке user_data пользователя %s: %s", user_id, e)
+            return
+        if data is not None:
+            for key, value in json.loads(data).items():
+                user_data.setdefault(key, value)
+        self._mark_loaded(user_id)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Запись всех накопленных изменений при остановке бота."""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write()
+
+    @property
+    def pending(self):
+        """Количество изменений, ожидающих записи."""
+        return len(self._user_data) + len(self._conversations)
+
+    def _schedule_flush(self):
+        # Application передаёт изменения пачкой через asyncio.gather, поэтому запись,
+        # запланированная первым изменением, выполняется после остальных
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._write())
+
+    async def _write(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            user_data, self._user_data = self._user_data, {}
+            conversations, self._conversations = self._conversations, {}
+            if not user_data and not conversations:
+                return
+            self._writing = user_data
+            try:
+                saved = await save_bot_state(
+                    [(user_id, data) for user_id, data in user_data.items() if data is not None],
+                    [user_id for user_id, data in user_data.items() if data is None],
+                    [(name, key, state) for (name, key), state in conversations.items() if state is not None],
+                    [(name, key) for (name, key), state in conversations.items() if state is None],
+                )
+            finally:
+                self._writing = {}
+            if not saved:
+                # Изменения возвращаются в буфер, если не были заменены более новыми,
+                # и записываются вместе со следующими изменениями или при остановке
+                for user_id, data in user_data.items():
+                    self._user_data.setdefault(user_id, data)
+                for key, state in conversations.items():
+                    self._conversations.setdefault(key, state)
+                return
+            logger.debug(
+                "Состояние бота записано: user_data %s, диалогов %s", len(user_data), len(conversations)
+            )
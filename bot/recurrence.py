@@ -0,0 +1,186 @@
+import re
+from datetime import datetime, timedelta
+
+from apscheduler.triggers.cron import CronTrigger
+from dateutil.relativedelta import relativedelta
+
+# Правила повторения хранятся в колонке tasks.recurrence строкой:
+#   daily, weekly, yearly, monthly:<число месяца>, cron:<выражение crontab>
+# В строке задачи хранится только ближайшее срабатывание, следующее вычисляется после отправки.
+
+_PERIODS = {
+    'день': 'daily',
+    'неделю': 'weekly',
+    'месяц': 'monthly',
+    'год': 'yearly',
+}
+
+_WEEKDAYS = {
+    'понедельник': 0,
+    'вторник': 1,
+    'среду': 2,
+    'четверг': 3,
+    'пятницу': 4,
+    'субботу': 5,
+    'воскресенье': 6,
+}
+
+_EVERY = ('каждый', 'каждую', 'каждое')
+
+_TIME_RE = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+_CRON_DAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+# Номера дней недели, кроме шага после '/'
+_CRON_DAY_RE = re.compile(r'(?<![/\d])\d+')
+
+
+def is_recurring(args):
+    """Проверка, начинаются ли аргументы /add с правила повторения."""
+    return bool(args) and args[0].lower() in _EVERY + ('cron',)
+
+
+def _parse_time(value):
+    match = _TIME_RE.match(value)
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError("Неверный формат времени. Используйте HH:MM.")
+    return int(match.group(1)), int(match.group(2))
+
+
+def _next_at(now, hour, minute, weekday=None):
+    """Ближайший момент после now с заданным временем (и днём недели)."""
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if weekday is not None:
+        candidate += timedelta(days=(weekday - candidate.weekday()) % 7)
+        if candidate <= now:
+            candidate += timedelta(weeks=1)
+    elif candidate <= now:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def _cron_day(match):
+    day = int(match.group())
+    if day > 7:
+        raise ValueError(f"день недели {day} вне диапазона 0-7")
+    return _CRON_DAYS[day % 7]
+
+
+def _cron_trigger(expression):
+    # В crontab 0 и 7 - воскресенье, а APScheduler нумерует дни с понедельника,
+    # поэтому номера дней недели заменяются названиями
+    fields = expression.split()
+    try:
+        if len(fields) != 5:
+            raise ValueError("ожидается 5 полей")
+        minute, hour, day, month, day_of_week = fields
+        day_of_week = _CRON_DAY_RE.sub(_cron_day, day_of_week)
+        return CronTrigger(minute=minute, hour=hour, day=day, month=month, day_of_week=day_of_week)
+    except ValueError as e:
+        raise ValueError(f"Неверное выражение cron: {e}")
+
+
+def _next_cron(expression, after):
+    trigger = _cron_trigger(expression)
+    fire_time = trigger.get_next_fire_time(None, after.astimezone() + timedelta(seconds=1))
+    if fire_time is None:
+        raise ValueError("Выражение cron не имеет будущих срабатываний.")
+    return fire_time.astimezone().replace(tzinfo=None)
+
+
+def parse_recurrence(args, now):
+    """Разбор правила повторения из аргументов /add.
+
+    Возвращает (правило, первый срок, текст задачи). Поддерживаются формы:
+    'каждый день 09:00 <текст>', 'каждую неделю 09:00 <текст>',
+    'каждый понедельник 09:00 <текст>', 'каждый месяц 09:00 <текст>',
+    'каждый год 09:00 <текст>' и 'cron <мин> <час> <день> <месяц> <день недели> <текст>'.
+    """
+    if args[0].lower() == 'cron':
+        if len(args) < 7:
+            raise ValueError("Недостаточно аргументов: '/add cron <мин> <час> <день> <месяц> <день недели> <текст>'")
+        expression = " ".join(args[1:6])
+        first = _next_cron(expression, now)
+        return f"cron:{expression}", first, " ".join(args[6:])
+
+    if len(args) < 4:
+        raise ValueError("Недостаточно аргументов: '/add каждый день 09:00 <текст>'")
+    period = args[1].lower()
+    hour, minute = _parse_time(args[2])
+    text = " ".join(args[3:])
+
+    if period in _WEEKDAYS:
+        return 'weekly', _next_at(now, hour, minute, _WEEKDAYS[period]), text
+    if period not in _PERIODS:
+        raise ValueError(
+            "Неверный период повторения. Поддерживаются: день, неделю, месяц, год или день недели."
+        )
+    rule = _PERIODS[period]
+    if rule == 'monthly':
+        # Число месяца берётся из дня создания, а не из перенесённого срока:
+        # 'каждый месяц 09:00' 31 января после 9:00 - это 31-е (в феврале - последний день)
+        rule = f"monthly:{now.day}"
+        first = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if first <= now:
+            first = next_occurrence(rule, first, now)
+        return rule, first, text
+    return rule, _next_at(now, hour, minute), text
+
+
+def validate_rule(rule):
+    """Проверка строки правила повторения (например, при импорте)."""
+    if rule in ('daily', 'weekly', 'yearly'):
+        return
+    if rule.startswith('monthly:') and rule[8:].isdigit() and 1 <= int(rule[8:]) <= 31:
+        return
+    if rule.startswith('cron:'):
+        _cron_trigger(rule[5:])
+        return
+    raise ValueError(f"Неизвестное правило повторения: {rule}")
+
+
+def next_occurrence(rule, previous, now=None):
+    """Следующий срок задачи после previous, строго позже now.
+
+    Пропущенные срабатывания (например, пока бот был остановлен) не повторяются.
+    """
+    now = now or datetime.now()
+    after = max(previous, now)
+    if rule.startswith('cron:'):
+        return _next_cron(rule[5:], after)
+
+    if rule in ('daily', 'weekly'):
+        period = timedelta(days=1) if rule == 'daily' else timedelta(weeks=1)
+        steps = max(1, -(-(after - previous) // period))
+        candidate = previous + period * steps
+        if candidate <= after:
+            candidate += period
+        return candidate
+
+    if rule == 'yearly':
+        unit, extra = 'years', {}
+    elif rule.startswith('monthly:'):
+        # Число месяца хранится в правиле, чтобы 31-е не превращалось навсегда в 28-е после февраля
+        unit, extra = 'months', {'day': int(rule[8:])}
+    else:
+        raise ValueError(f"Неизвестное правило повторения: {rule}")
+    k = 1
+    while True:
+        candidate = previous + relativedelta(**{unit: k}, **extra)
+        if candidate > after:
+            return candidate
+        k += 1
+
+
+def describe(rule):
+    """Описание правила повторения для пользователя."""
+    if rule == 'daily':
+        return "каждый день"
+    if rule == 'weekly':
+        return "каждую неделю"
+    if rule == 'yearly':
+        return "каждый год"
+    if rule.startswith('monthly:'):
+        return f"каждый месяц ({rule[8:]} числа)"
+    if rule.startswith('cron:'):
+        return f"по расписанию cron '{rule[5:]}'"
+    return rule
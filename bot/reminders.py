@@ -0,0 +1,230 @@
+import asyncio
+import functools
+import heapq
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from db import get_pending_reminders, claim_reminders, mark_delivered, advance_recurring
+from logsetup import correlation_id
+from recurrence import next_occurrence
+
+# Горизонт (в минутах), на который напоминания загружаются в память
+REMINDER_HORIZON_MINUTES = float(os.getenv("REMINDER_HORIZON_MINUTES", "10"))
+# Размер порции при выборке напоминаний из базы данных
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+# Максимальное число напоминаний, одновременно хранящихся в памяти
+REMINDER_MAX_PENDING = int(os.getenv("REMINDER_MAX_PENDING", "10000"))
+# Интервал (в секундах) между перечитываниями горизонта из базы данных
+REMINDER_REFRESH_SECONDS = float(os.getenv("REMINDER_REFRESH_SECONDS", "60"))
+# Срок аренды напоминания экземпляром (в секундах); должен покрывать время в очереди отправки
+REMINDER_LEASE_SECONDS = float(os.getenv("REMINDER_LEASE_SECONDS", "300"))
+# Идентификатор экземпляра бота для аренды напоминаний
+REMINDER_INSTANCE_ID = os.getenv("REMINDER_INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+logger = logging.getLogger(__name__)
+
+
+class ReminderDispatcher:
+    """Диспетчер напоминаний, использующий таблицу задач как источник истины.
+
+    В памяти хранится только куча ближайших напоминаний в пределах горизонта.
+    Горизонт периодически перечитывается из базы данных порциями, поэтому после
+    перезапуска ничего не теряется и не требуется загружать все будущие задачи.
+
+    Куча служит только подсказкой, когда проснуться: наступившие напоминания
+    арендуются в базе данных через FOR UPDATE SKIP LOCKED, поэтому при нескольких
+    экземплярах бота каждое напоминание отправляет ровно один из них.
+    send(user_id, text, due_date) возвращает future, который завершается True,
+    если напоминание больше не нужно отправлять, и False, если отправку нужно повторить
+    после истечения аренды.
+
+    Доставленная разовая задача переносится в архив. Повторяющаяся задача хранится
+    одной строкой: в архив записывается сработавшее повторение, а её срок
+    переносится на следующее срабатывание правила.
+    """
+
+    def __init__(
+        self,
+        send,
+        horizon=timedelta(minutes=REMINDER_HORIZON_MINUTES),
+        batch_size=REMINDER_BATCH_SIZE,
+        max_pending=REMINDER_MAX_PENDING,
+        refresh_interval=REMINDER_REFRESH_SECONDS,
+        lease_seconds=REMINDER_LEASE_SECONDS,
+        instance_id=REMINDER_INSTANCE_ID,
+    ):
+        self._send = send
+        self._lease_seconds = lease_seconds
+        self.instance_id = instance_id
+        # Доставленные напоминания (task_id, правило повторения, срок), ожидающие отметки в базе данных
+        self._delivered = []
+        self._horizon = horizon
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._refresh_interval = refresh_interval
+        # Куча пар (due_date, task_id) и актуальная дата для каждой задачи в памяти
+        self._heap = []
+        self._scheduled = {}
+        # Все напоминания до этого момента гарантированно находятся в памяти
+        self._loaded_until = datetime.min
+        self._next_refresh = datetime.min
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def pending(self):
+        """Количество напоминаний, хранящихся в памяти."""
+        return len(self._scheduled)
+
+    def start(self):
+        """Запуск цикла диспетчера в текущем цикле событий."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info("Диспетчер напоминаний запущен.")
+
+    async def stop(self):
+        """Остановка цикла диспетчера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Диспетчер напоминаний остановлен.")
+
+    async def flush(self):
+        """Отметить в базе данных все доставленные напоминания."""
+        if not self._delivered:
+            return
+        delivered, self._delivered = self._delivered, []
+        now = datetime.now()
+        once, recurring, advanced = [], [], []
+        for item in delivered:
+            task_id, rule, due_date = item
+            if rule is not None:
+                try:
+                    advanced.append((task_id, due_date, next_occurrence(rule, due_date, now)))
+                    recurring.append(item)
+                    continue
+                except ValueError as e:
+                    # Задача с неверным правилом считается разовой, чтобы не повторяться бесконечно
+                    logger.error("Неверное правило повторения задачи %s: %s", task_id, e)
+            once.append(item)
+        # Повторим при следующей итерации; до истечения аренды задачи никто не заберёт
+        if once and not await mark_delivered([item[0] for item in once], self.instance_id, now):
+            self._delivered.extend(once)
+        if advanced:
+            if not await advance_recurring(advanced, self.instance_id, now):
+                self._delivered.extend(recurring)
+                return
+            self.notify_many((task_id, due_date) for task_id, _, due_date in advanced)
+
+    def notify(self, task_id, due_date):
+        """Сообщить диспетчеру о новой или изменённой задаче."""
+        self._scheduled.pop(task_id, None)
+        if due_date <= self._loaded_until:
+            self._push(task_id, due_date)
+            self._wakeup.set()
+
+    def notify_many(self, items):
+        """Сообщить диспетчеру о нескольких изменённых задачах: пары (task_id, due_date)."""
+        for task_id, due_date in items:
+            self._scheduled.pop(task_id, None)
+            if due_date <= self._loaded_until:
+                self._push(task_id, due_date)
+        self._wakeup.set()
+
+    def discard(self, *task_ids):
+        """Сообщить диспетчеру об удалённых задачах."""
+        for task_id in task_ids:
+            self._scheduled.pop(task_id, None)
+
+    def refresh(self):
+        """Перечитать горизонт из базы данных при следующей итерации."""
+        self._next_refresh = datetime.min
+        self._wakeup.set()
+
+    def _push(self, task_id, due_date):
+        self._scheduled[task_id] = due_date
+        heapq.heappush(self._heap, (due_date, task_id))
+
+    async def _reload(self, now):
+        """Загрузка напоминаний в пределах горизонта порциями."""
+        until = now + self._horizon
+        self._heap = []
+        self._scheduled = {}
+        after = None
+        while True:
+            limit = min(self._batch_size, self._max_pending - len(self._scheduled))
+            rows = await get_pending_reminders(until, limit, after)
+            for row in rows:
+                self._push(row['id'], row['due_date'])
+            if len(rows) < limit:
+                self._loaded_until = until
+                break
+            after = (rows[-1]['due_date'], rows[-1]['id'])
+            if len(self._scheduled) >= self._max_pending:
+                # Горизонт не поместился в память - сужаем его до последней загруженной задачи
+                self._loaded_until = after[0]
+                logger.warning("Горизонт напоминаний сокращён до %s из-за лимита %s.", after[0], self._max_pending)
+                break
+        self._next_refresh = now + timedelta(seconds=self._refresh_interval)
+
+    def _pop_due(self, now):
+        """Извлечение из кучи всех наступивших напоминаний."""
+        due_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due_date, task_id = heapq.heappop(self._heap)
+            # Пропускаем удалённые задачи и устаревшие записи изменённых задач
+            if self._scheduled.get(task_id) == due_date:
+                del self._scheduled[task_id]
+                due_ids.append(task_id)
+        return due_ids
+
+    def _on_sent(self, row, future):
+        if future.cancelled() or future.exception() is not None or not future.result():
+            return
+        self._delivered.append((row['id'], row['recurrence'], row['due_date']))
+        self._wakeup.set()
+
+    async def _dispatch(self, now):
+        if self._pop_due(now):
+            while True:
+                rows = await claim_reminders(now, self._batch_size, self.instance_id, self._lease_seconds)
+                for row in rows:
+                    token = correlation_id.set(f"reminder-{row['id']}")
+                    try:
+                        future = await self._send(row['user_id'], row['text'], row['due_date'])
+                    finally:
+                        correlation_id.reset(token)
+                    future.add_done_callback(functools.partial(self._on_sent, row))
+                if len(rows) < self._batch_size:
+                    break
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                now = datetime.now()
+                if now >= self._next_refresh:
+                    await self._reload(now)
+                await self._dispatch(now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка в диспетчере напоминаний: %s", e)
+                self._next_refresh = datetime.now() + timedelta(seconds=5)
+
+            now = datetime.now()
+            timeout = (self._next_refresh - now).total_seconds()
+            if self._heap:
+                timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
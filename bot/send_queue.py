@@ -0,0 +1,303 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from logsetup import correlation_id
+from metrics import TELEGRAM_ERRORS
+
+# Глобальный лимит Telegram на исходящие сообщения (сообщений в секунду)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+# Лимит на один чат (сообщений в секунду) и допустимый всплеск
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+# Количество параллельных отправителей
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+# Максимальное количество повторов одного сообщения
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+
+# Приоритеты очереди: ответы пользователю отправляются раньше напоминаний
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REMINDER = 1
+
+# Максимальное количество чатов, для которых хранятся счётчики
+_MAX_CHAT_BUCKETS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Маркерная корзина для ограничения частоты отправки."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Время (в секундах) до появления свободного маркера."""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("chat_id", "factory", "priority", "future", "enqueued", "attempts", "correlation_id")
+
+    def __init__(self, chat_id, factory, priority, future):
+        self.chat_id = chat_id
+        self.factory = factory
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        # Идентификатор обновления или напоминания, для которого отправляется сообщение
+        self.correlation_id = correlation_id.get()
+
+
+class SendQueue:
+    """Очередь исходящих сообщений с учётом лимитов Telegram.
+
+    Все вызовы Bot API, отправляющие сообщения, передаются в очередь как фабрики
+    корутин. Очередь соблюдает глобальный лимит и лимит на чат, отдаёт приоритет
+    интерактивным ответам и повторяет отправку после RetryAfter и сетевых ошибок.
+
+    Сообщения одного чата с одинаковым приоритетом отправляются строго в порядке
+    поступления: в общей очереди находится только первое сообщение чата, остальные
+    ждут в очередях чата по приоритетам. Следующим отправляется первое сообщение из
+    очереди с более высоким приоритетом, поэтому ответ пользователю не ждёт всех
+    накопившихся напоминаний.
+    """
+
+    def __init__(
+        self,
+        global_rate=SEND_GLOBAL_RATE,
+        chat_rate=SEND_CHAT_RATE,
+        chat_burst=SEND_CHAT_BURST,
+        workers=SEND_WORKERS,
+        max_retries=SEND_MAX_RETRIES,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats = OrderedDict()
+        # chat_id -> {приоритет: сообщения, ожидающие отправки предыдущего сообщения чата}
+        self._chat_queues = {}
+        self._workers_count = workers
+        self._max_retries = max_retries
+        self._queue = None
+        self._workers = []
+        self._seq = itertools.count()
+        # Отправка приостановлена до этого момента после RetryAfter
+        self._paused_until = 0.0
+        # Количество незавершённых сообщений (в очереди, отложенных и отправляемых)
+        self._unfinished = 0
+        self._idle = None
+        self._depth = {PRIORITY_INTERACTIVE: 0, PRIORITY_REMINDER: 0}
+        self._deferred = 0
+        self._stats = {
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "retry_after": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+        self._errors = {}
+
+    def start(self):
+        """Запуск отправителей в текущем цикле событий."""
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self._workers_count)]
+        logger.info("Очередь отправки запущена (%s отправителей).", self._workers_count)
+
+    async def stop(self, timeout=10.0):
+        """Остановка очереди с ожиданием отправки накопленных сообщений."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Очередь отправки остановлена, не отправлено сообщений: %s", self._unfinished)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Очередь отправки остановлена.")
+
+    def submit(self, chat_id, factory, priority=PRIORITY_INTERACTIVE):
+        """Поставить сообщение в очередь; возвращает future с результатом отправки."""
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(chat_id, factory, priority, future)
+        self._unfinished += 1
+        self._idle.clear()
+        self._depth[priority] += 1
+        lanes = self._chat_queues.get(chat_id)
+        if lanes is None:
+            self._chat_queues[chat_id] = {PRIORITY_INTERACTIVE: deque(), PRIORITY_REMINDER: deque()}
+            self._put(job)
+        else:
+            lanes[priority].append(job)
+        return future
+
+    async def send(self, chat_id, factory, priority=PRIORITY_INTERACTIVE):
+        """Отправить сообщение через очередь и дождаться результата."""
+        return await self.submit(chat_id, factory, priority)
+
+    def stats(self):
+        """Метрики очереди: глубина по приоритетам, задержка и счётчики ошибок."""
+        sent = self._stats["sent"]
+        return {
+            "depth_interactive": self._depth[PRIORITY_INTERACTIVE],
+            "depth_reminder": self._depth[PRIORITY_REMINDER],
+            "deferred": self._deferred,
+            "unfinished": self._unfinished,
+            "sent": sent,
+            "failed": self._stats["failed"],
+            "retries": self._stats["retries"],
+            "retry_after": self._stats["retry_after"],
+            "latency_avg": self._stats["latency_total"] / sent if sent else 0.0,
+            "latency_max": self._stats["latency_max"],
+            "errors": dict(self._errors),
+        }
+
+    def _put(self, job):
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _defer(self, job, delay):
+        """Вернуть сообщение в очередь через delay секунд.
+
+        Остальные сообщения чата всё это время ждут в его очереди.
+        """
+        def put():
+            self._deferred -= 1
+            self._depth[job.priority] += 1
+            self._put(job)
+
+        self._deferred += 1
+        asyncio.get_running_loop().call_later(delay, put)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+            if len(self._chats) > _MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _finish(self, job):
+        # В общую очередь переходит следующее сообщение этого чата, начиная с ответов
+        lanes = self._chat_queues.get(job.chat_id)
+        if lanes is not None:
+            for priority in (PRIORITY_INTERACTIVE, PRIORITY_REMINDER):
+                if lanes[priority]:
+                    self._put(lanes[priority].popleft())
+                    break
+            else:
+                del self._chat_queues[job.chat_id]
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._idle.set()
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            self._depth[job.priority] -= 1
+            correlation_id.set(job.correlation_id)
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error("Ошибка в очереди отправки: %s", e)
+                if not job.future.done():
+                    job.future.set_exception(e)
+                self._finish(job)
+
+    async def _process(self, job):
+        if job.future.cancelled():
+            self._finish(job)
+            return
+
+        # Лимит на чат: чат откладывается целиком, чтобы не блокировать другие чаты
+        chat_delay = self._chat_bucket(job.chat_id).delay()
+        if chat_delay > 0:
+            self._defer(job, chat_delay)
+            return
+
+        # Глобальный лимит и пауза после RetryAfter касаются всех сообщений
+        while True:
+            delay = max(self._paused_until - time.monotonic(), self._global.delay())
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self._global.consume()
+        self._chat_bucket(job.chat_id).consume()
+
+        job.attempts += 1
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            self._stats["retry_after"] += 1
+            self._count_error(e)
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logger.warning("Превышен лимит Telegram, пауза %s с.", e.retry_after)
+            self._retry_or_fail(job, e, e.retry_after)
+            return
+        except BadRequest as e:
+            self._count_error(e)
+            self._fail(job, e)
+            return
+        except NetworkError as e:
+            self._count_error(e)
+            self._retry_or_fail(job, e, min(2 ** job.attempts, 30))
+            return
+        except Exception as e:
+            self._count_error(e)
+            self._fail(job, e)
+            return
+
+        latency = time.monotonic() - job.enqueued
+        self._stats["sent"] += 1
+        self._stats["latency_total"] += latency
+        if latency > self._stats["latency_max"]:
+            self._stats["latency_max"] = latency
+        if not job.future.done():
+            job.future.set_result(result)
+        self._finish(job)
+
+    def _retry_or_fail(self, job, error, delay):
+        if job.attempts > self._max_retries:
+            self._fail(job, error)
+            return
+        self._stats["retries"] += 1
+        self._defer(job, delay)
+
+    def _fail(self, job, error):
+        self._stats["failed"] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+        self._finish(job)
+
+    def _count_error(self, error):
+        name = type(error).__name__
+        self._errors[name] = self._errors.get(name, 0) + 1
+        TELEGRAM_ERRORS.inc(type=name)
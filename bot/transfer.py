@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+from recurrence import next_occurrence, validate_rule
+
+# Поддерживаемые форматы файлов /export и /import
+FORMATS = ('csv', 'json')
+# Столбцы файла в порядке записи
+FIELDS = ('text', 'due_date', 'recurrence', 'delivered_at')
+# Количество задач в одной порции при импорте
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# Максимальное количество задач в одном файле импорта
+IMPORT_MAX_TASKS = int(os.getenv("IMPORT_MAX_TASKS", "50000"))
+# Максимальная длина текста задачи
+TASK_TEXT_MAX_LENGTH = 4000
+
+_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Размер блока при потоковом разборе JSON
+_JSON_READ_SIZE = 64 * 1024
+
+
+class ImportFileError(ValueError):
+    """Ошибка в файле импорта с номером записи."""
+
+    def __init__(self, number, message):
+        super().__init__(f"Запись {number}: {message}")
+
+
+def _format_date(value):
+    return value.strftime(_DATE_FORMAT) if value is not None else None
+
+
+async def write_export(rows, fmt, out):
+    """Запись задач из асинхронного итератора rows в текстовый поток out.
+
+    JSON записывается как массив, по одному объекту на строку, чтобы файл
+    можно было сформировать, не держа все задачи в памяти.
+    """
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(FIELDS)
+        async for row in rows:
+            writer.writerow([row['text'], _format_date(row['due_date']), row['recurrence'] or '',
+                             _format_date(row['delivered_at']) or ''])
+            count += 1
+    else:
+        out.write("[\n")
+        async for row in rows:
+            if count:
+                out.write(",\n")
+            out.write(json.dumps({
+                'text': row['text'],
+                'due_date': _format_date(row['due_date']),
+                'recurrence': row['recurrence'],
+                'delivered_at': _format_date(row['delivered_at']),
+            }, ensure_ascii=False))
+            count += 1
+        out.write("\n]\n")
+    return count
+
+
+def _iter_csv(stream):
+    reader = csv.DictReader(stream)
+    if reader.fieldnames is None or not {'text', 'due_date'} <= set(reader.fieldnames):
+        raise ValueError("В CSV должны быть столбцы text и due_date.")
+    yield from reader
+
+
+def _iter_json(stream):
+    """Потоковый разбор JSON-массива объектов без загрузки файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Пропуск пробелов и разделителей массива
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] in ",]"):
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError("JSON-файл должен содержать массив задач.")
+                started = True
+                position += 1
+                continue
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+                yield item
+                continue
+            except json.JSONDecodeError:
+                # Объект не поместился в буфер - дочитываем файл
+                if eof:
+                    raise ValueError("Неверный формат JSON.")
+        elif eof:
+            return
+        chunk = stream.read(_JSON_READ_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def _parse_date(value, number, field, required=True):
+    if value in (None, ''):
+        if required:
+            raise ImportFileError(number, f"не указано поле {field}")
+        return None
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ImportFileError(number, f"неверная дата в поле {field}: {value!r}")
+
+
+def _validate(item, number, now):
+    if not isinstance(item, dict):
+        raise ImportFileError(number, "ожидается объект с полями text и due_date")
+    text = str(item.get('text') or '').strip()
+    if not text:
+        raise ImportFileError(number, "пустой текст задачи")
+    if len(text) > TASK_TEXT_MAX_LENGTH:
+        raise ImportFileError(number, f"текст длиннее {TASK_TEXT_MAX_LENGTH} символов")
+    due_date = _parse_date(item.get('due_date'), number, 'due_date')
+    delivered_at = _parse_date(item.get('delivered_at'), number, 'delivered_at', required=False)
+    recurrence = item.get('recurrence') or None
+    if recurrence is not None:
+        if not isinstance(recurrence, str):
+            raise ImportFileError(number, f"правило повторения должно быть строкой: {recurrence!r}")
+        try:
+            validate_rule(recurrence)
+        except ValueError as e:
+            raise ImportFileError(number, str(e))
+        # У повторяющейся задачи хранится только ближайшее срабатывание
+        delivered_at = None
+        if due_date <= now:
+            due_date = next_occurrence(recurrence, due_date, now)
+    return text, due_date, recurrence, delivered_at
+
+
+def iter_import_chunks(stream, fmt, now, chunk_size=IMPORT_CHUNK_SIZE, max_tasks=IMPORT_MAX_TASKS):
+    """Разбор и проверка файла импорта порциями.
+
+    Возвращает генератор списков кортежей (text, due_date, recurrence, delivered_at)
+    длиной не более chunk_size. При первой ошибке выбрасывается ValueError.
+    """
+    items = _iter_csv(stream) if fmt == 'csv' else _iter_json(stream)
+    chunk = []
+    for number, item in enumerate(items, start=1):
+        if number > max_tasks:
+            raise ValueError(f"В файле больше {max_tasks} задач.")
+        chunk.append(_validate(item, number, now))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def detect_format(file_name, mime_type=None):
+    """Формат файла импорта по расширению или MIME-типу."""
+    name = (file_name or '').lower()
+    if name.endswith('.json') or mime_type == 'application/json':
+        return 'json'
+    if name.endswith('.csv') or mime_type in ('text/csv', 'text/comma-separated-values'):
+        return 'csv'
+    return None
+
+
+def text_stream(binary, encoding='utf-8-sig'):
+    """Текстовая обёртка над двоичным файлом для csv/json; при чтении пропускает BOM."""
+    return io.TextIOWrapper(binary, encoding=encoding, newline='')
@@ -0,0 +1,85 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from logsetup import correlation_id
+
+# Лимит общего семафора PTB: фактически без ограничения
+_UNLIMITED = 2 ** 30
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления разных пользователей обрабатываются одновременно (не более
+    max_concurrent_updates), а обновления одного пользователя - строго по очереди,
+    чтобы ConversationHandler видел их в порядке поступления.
+
+    Общий семафор PTB получает заведомо большой лимит, а max_concurrent_updates
+    ограничивается собственным семафором, который берётся уже после блокировки
+    пользователя: обновления, ждущие своей очереди, не занимают слоты обработки.
+
+    on_first_update вызывается один раз, после обработки первого обновления
+    (для измерения холодного старта).
+    """
+
+    __slots__ = ("_locks", "_on_first_update", "_limit", "_slots")
+
+    def __init__(self, max_concurrent_updates, on_first_update=None):
+        # Лимит PTB больше 1, поэтому Application создаёт задачу на каждое обновление
+        super().__init__(_UNLIMITED)
+        # user_id -> [блокировка, количество ожидающих её обновлений]
+        self._locks = {}
+        self._on_first_update = on_first_update
+        self._limit = max_concurrent_updates
+        # Создаётся в цикле событий приложения при первом обновлении
+        self._slots = None
+
+    def _key(self, update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        # process_update из PTB помечен @final, поэтому порядок блокировок задаётся здесь
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._limit)
+        key = self._key(update)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def _run(self, update, coroutine):
+        async with self._slots:
+            await self._handle(update, coroutine)
+
+    async def _handle(self, update, coroutine):
+        # Каждое обновление обрабатывается в отдельной задаче asyncio, поэтому
+        # идентификатор виден только записям лога этого обновления
+        if isinstance(update, Update):
+            correlation_id.set(f"update-{update.update_id}")
+        await coroutine
+        if self._on_first_update is not None:
+            callback, self._on_first_update = self._on_first_update, None
+            callback()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass